@@ -0,0 +1,71 @@
+""" Benchmark stat_loader.to_postgres rows/sec for each load method, and
+    for copying with each number of `jobs`.
+
+    Needs a local PostgreSQL server with a database to load into.
+
+    Usage: python benchmarks/bench_stat_loader.py [db_name] [n_rows]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.schema import DropSchema
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pyharness import stat_logger
+from pyharness.stat_loader import to_postgres
+
+TABLES = ['iter_%d' % i for i in range(4)]
+
+JOBS = [1, 2, 4]
+
+def write_dump(log_dir, n_rows):
+    stat_logger.configure(settings={'log_dir': log_dir},
+                          defaults={'grid_point_id': 0, 'run_id': 0})
+    stat_logger.requireLoggers(*TABLES)
+    loggers = [stat_logger.getLogger(table_name) for table_name in TABLES]
+    for i in xrange(n_rows):
+        logger = loggers[i % len(loggers)]
+        logger.log(timestep=i, val=i * 0.5, name='agent %d' % (i % 10),
+                   done=i % 2 == 0, extra={'a': i, 'b': None})
+        logger.end_row()
+    stat_logger.finalize()
+
+def bench(db_name, log_dir, method, n_rows, jobs=1):
+    schema_name = 'pyharness_bench_%s_%d' % (method, jobs)
+    db = create_engine("postgresql://localhost/" + db_name)
+    start = time.time()
+    to_postgres(log_dir, db_name, schema_name, method=method, jobs=jobs)
+    elapsed = time.time() - start
+    n_loaded = sum(db.execute('SELECT count(*) FROM %s.%s'
+                              % (schema_name, table_name)).scalar()
+                   for table_name in TABLES)
+    db.execute(DropSchema(schema_name, cascade=True))
+    db.dispose()
+    if n_loaded != n_rows:
+        raise AssertionError("%s with %d jobs loaded %d of %d rows"
+                             % (method, jobs, n_loaded, n_rows))
+    return n_rows / elapsed
+
+def main():
+    db_name = sys.argv[1] if len(sys.argv) > 1 else 'pyharness-db'
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    log_dir = tempfile.mkdtemp()
+    try:
+        write_dump(log_dir, n_rows)
+        results = [(method, 1, bench(db_name, log_dir, method, n_rows))
+                   for method in ('insert', 'copy')]
+        results += [('copy', jobs, bench(db_name, log_dir, 'copy', n_rows,
+                                         jobs))
+                    for jobs in JOBS if jobs > 1]
+    finally:
+        shutil.rmtree(log_dir)
+    print
+    for method, jobs, rate in results:
+        print "%-8s %2d jobs %12.0f rows/sec" % (method, jobs, rate)
+
+if __name__ == '__main__':
+    main()
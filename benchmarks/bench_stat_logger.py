@@ -0,0 +1,38 @@
+""" Benchmark StatLogger rows/sec for each writer backend.
+
+    Usage: python benchmarks/bench_stat_logger.py [n_rows]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pyharness import stat_logger
+
+def bench(writer, n_rows):
+    log_dir = tempfile.mkdtemp()
+    try:
+        stat_logger.reset()
+        stat_logger.configure(settings={'log_dir': log_dir, 'writer': writer},
+                              defaults={'grid_point_id': 0, 'run_id': 0})
+        stat_logger.requireLoggers('iter')
+        logger = stat_logger.getLogger('iter')
+        start = time.time()
+        for i in xrange(n_rows):
+            logger.log(timestep=i, val=i * 0.5, name='agent')
+            logger.end_row()
+        stat_logger.finalize()
+        return n_rows / (time.time() - start)
+    finally:
+        stat_logger.reset()
+        shutil.rmtree(log_dir)
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for writer in ('logging', 'buffered'):
+        print "%-10s %12.0f rows/sec" % (writer, bench(writer, n_rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+""" adaptive: sequential sampling of grid point runs.
+
+    Rather than running every grid point a fixed number of times, a sweep can
+    watch a logged metric and stop replicating a grid point once the 95%
+    confidence interval around the metric's mean is narrow enough. Each run
+    contributes one sample: the mean of the metric over the rows it logged.
+    See `ParamGrid.run()`.
+
+    Successive halving (`ParamGrid.search()`) uses the same samples to rank
+    grid points by an objective.
+"""
+import math
+
+import stat_logger
+
+# two-sided 95% critical values of Student's t distribution, by degrees of
+# freedom. Degrees of freedom between entries use the next lower entry.
+T_975 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+    8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160,
+    14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093,
+    20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060,
+    26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042, 40: 2.021,
+    60: 2.000, 120: 1.980,
+}
+
+def t_critical(df):
+    """ The two-sided 95% critical value of t with `df` degrees of freedom.
+    """
+    return T_975[max(k for k in T_975 if k <= df)]
+
+class RunningStats(object):
+    """ The mean and variance of a stream of samples (Welford's method). """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else float('inf')
+
+    def ci_width(self):
+        """ The width of the 95% confidence interval around the mean. """
+        if self.n < 2:
+            return float('inf')
+        return 2 * t_critical(self.n - 1) * math.sqrt(self.variance() / self.n)
+
+class MetricTracker(object):
+    def __init__(self, table_name, metric):
+        """ Collect a sample of `metric` (a column of `table_name`, which may
+        name a nested value as 'outer.inner') from each run, and keep
+        running statistics of the samples at each grid point.
+        """
+        self.table_name = table_name
+        self.metric = metric
+        self.stats = {}
+        self.values = []
+
+    def watch(self):
+        """ Start collecting the metric from rows as they are logged. """
+        stat_logger.addRowHook(self.table_name, self._observe)
+
+    def unwatch(self):
+        stat_logger.removeRowHook(self.table_name, self._observe)
+
+    def _observe(self, row):
+        value = row.get(self.metric)
+        if value is None and '.' in self.metric:
+            value = row
+            for key in self.metric.split('.'):
+                value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, (int, long, float)):
+            self.values.append(float(value))
+
+    def end_run(self):
+        """ Return the sample from the run that just finished (None if it
+        didn't log the metric), and start collecting a new one.
+        """
+        values, self.values = self.values, []
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def add(self, grid_point_id, value):
+        """ Add a run's sample to its grid point. """
+        if value is not None:
+            self.stats.setdefault(grid_point_id, RunningStats()).add(value)
+
+    def n_samples(self, grid_point_id):
+        stats = self.stats.get(grid_point_id)
+        return stats.n if stats else 0
+
+    def mean(self, grid_point_id):
+        stats = self.stats.get(grid_point_id)
+        return stats.mean if stats else None
+
+    def ci_width(self, grid_point_id):
+        stats = self.stats.get(grid_point_id)
+        return stats.ci_width() if stats else float('inf')
+
+    def converged(self, grid_point_id):
+        return False
+
+class Convergence(MetricTracker):
+    def __init__(self, table_name, metric, ci_width, min_runs=3):
+        """ Track `metric` in `table_name` (see `MetricTracker`) to tell when
+        a grid point has had enough runs.
+
+        A grid point has converged once it has at least `min_runs` samples
+        and the 95% confidence interval of their mean is at most `ci_width`
+        wide.
+        """
+        super(Convergence, self).__init__(table_name, metric)
+        self.target = ci_width
+        self.min_runs = max(min_runs, 2)
+
+    def converged(self, grid_point_id):
+        return (self.n_samples(grid_point_id) >= self.min_runs
+                and self.ci_width(grid_point_id) <= self.target)
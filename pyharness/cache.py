@@ -0,0 +1,182 @@
+""" cache: an on-disk cache of query results for plot functions.
+
+    Plotting usually re-runs the same queries against data that hasn't
+    changed. A ResultCache stores each result under `<out_dir>/_cache/`,
+    keyed on the query and a fingerprint of the data it was computed from:
+    the load watermarks of a DB schema, or the sizes and modification times
+    of the dumps in a log directory. Loading new data changes the
+    fingerprint, so stale results are never returned, and are replaced the
+    next time their query is run.
+
+    Usage in an experiment's `plot()`:
+
+        from pyharness.cache import ResultCache
+
+        def plot(experiment_name, out_dir, db_name):
+            cache = ResultCache(out_dir)
+            rows = cache.query(db_name, experiment_name,
+                               "SELECT x, avg(score) FROM scores GROUP BY x")
+            # or, for results computed straight from the logs:
+            means = cache.cached_dump(log_dir, 'mean scores',
+                                      lambda: compute_means(log_dir))
+            cache.close()
+
+    The cache holds at most `max_bytes` of results (`CACHE_CONFIG` by
+    default), evicting the least recently used ones first.
+"""
+import cPickle
+import glob
+import hashlib
+import os
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+import columnar
+import fileutil
+from stat_loader import watermark_table
+from stat_logger import table_files
+
+CACHE_DIR = '_cache'
+
+CACHE_CONFIG = {
+    'max_bytes': 1 << 30,
+}
+
+class ResultCache(object):
+    def __init__(self, out_dir, max_bytes=None):
+        """ Open the cache under `out_dir`, holding at most `max_bytes` of
+        results (defaults to `CACHE_CONFIG['max_bytes']`).
+        """
+        self.path = os.path.join(out_dir, CACHE_DIR)
+        self.max_bytes = (CACHE_CONFIG['max_bytes'] if max_bytes is None
+                          else max_bytes)
+        self.engines = {} # db name -> engine, made on first use
+        fileutil.makedirs(self.path)
+
+    def cached(self, key, fingerprint, compute):
+        """ Return the result cached for `key` and `fingerprint`, or call
+        `compute()` and cache its result (which must be picklable).
+        """
+        filename = self._filename(key, fingerprint)
+        try:
+            with open(filename, 'rb') as f:
+                result = cPickle.load(f)
+        except Exception:
+            pass # not cached, or unreadable
+        else:
+            os.utime(filename, None) # mark as recently used
+            return result
+
+        result = compute()
+        self._store(filename, result)
+        return result
+
+    def query(self, db_name, schema_name, sql, params=None):
+        """ Run `sql` on `db_name` and return its rows as a list of tuples,
+        cached until new data is loaded into `schema_name`. Results aren't
+        cached if the schema's data can't be fingerprinted (see
+        `db_fingerprint`).
+
+        `params` are bound to `:name` placeholders in `sql`.
+        """
+        db = self.engines.get(db_name)
+        if db is None:
+            db = self.engines[db_name] = create_engine(
+                "postgresql://localhost/" + db_name)
+        def compute():
+            result = db.execute(text(sql), params or {})
+            return [tuple(row) for row in result]
+        fingerprint = db_fingerprint(db, schema_name)
+        if fingerprint is None:
+            return compute()
+        key = repr((db_name, schema_name, sql, sorted((params or {}).items())))
+        return self.cached(key, fingerprint, compute)
+
+    def cached_dump(self, log_dir, key, compute):
+        """ Return the result of `compute()` for the logs in `log_dir`,
+        cached until any table in `log_dir` changes.
+        """
+        return self.cached(repr((os.path.abspath(log_dir), key)),
+                           dump_fingerprint(log_dir), compute)
+
+    def close(self):
+        """ Close the connections `query()` opened. """
+        for db in self.engines.itervalues():
+            db.dispose()
+        self.engines = {}
+
+    def clear(self):
+        """ Remove every cached result. """
+        for filename in self._entries():
+            os.remove(filename)
+
+    def _filename(self, key, fingerprint):
+        # results for the same key share a prefix, so new data replaces them
+        return os.path.join(self.path, '%s-%s.pkl' % (_digest(key),
+                                                      _digest(fingerprint)))
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.path, '*.pkl'))
+
+    def _store(self, filename, result):
+        prefix = os.path.basename(filename).split('-')[0]
+        for stale in glob.glob(os.path.join(self.path, prefix + '-*.pkl')):
+            os.remove(stale)
+
+        with fileutil.atomic_write(filename) as f:
+            cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for filename in self._entries():
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+def db_fingerprint(db, schema_name):
+    """ Fingerprint the data loaded into `schema_name` by its watermarks.
+
+    The watermark table's OID is included too, since an overwriting load
+    recreates the schema but may leave the same watermarks.
+
+    Returns None if the watermarks can't be read, e.g., if the schema's data
+    wasn't loaded by stat_loader, so nothing would tell when it changed.
+    """
+    table = watermark_table(schema_name)
+    try:
+        oid = db.execute(text('SELECT CAST(CAST(:name AS regclass) AS oid)'),
+                         name=db.dialect.identifier_preparer.format_table(
+                             table)).scalar()
+        watermarks = sorted(tuple(row) for row in db.execute(table.select()))
+    except DBAPIError:
+        return None
+    return repr((schema_name, oid, watermarks))
+
+def dump_fingerprint(log_dir):
+    """ Fingerprint the tables dumped to `log_dir` by their sizes and
+    modification times.
+    """
+    stats = []
+    for table_name, filename in table_files(log_dir):
+        stat = os.stat(filename)
+        stats.append((table_name, stat.st_size, stat.st_mtime))
+    for table_name, path in columnar.table_dirs(log_dir):
+        stat = os.stat(os.path.join(path, columnar.INDEX_FILE))
+        stats.append((table_name, stat.st_size, stat.st_mtime))
+    return repr(sorted(stats))
+
+def _digest(text):
+    return hashlib.sha1(text).hexdigest()
@@ -0,0 +1,69 @@
+""" checkpoint: a manifest of completed grid point runs, for resuming sweeps.
+
+    The manifest is a file of JSON lines next to the logs. Each line records a
+    completed `(grid_point_id, run_id)` and the byte offsets every table had
+    been written up to when it finished, so a resumed sweep can skip finished
+    work and roll the tables back to the last committed row. Runs of adaptive
+    sweeps also record their sample of the metric being watched.
+"""
+import json
+import os
+
+import fileutil
+
+MANIFEST_FILE = '_manifest.jsonl'
+
+class Manifest(object):
+    def __init__(self, log_dir, resume=False):
+        """ Open the manifest in `log_dir`.
+
+        If `resume` is set, previously completed runs are read back and new
+        ones are appended. Otherwise the manifest starts out empty.
+        """
+        self.filename = os.path.join(log_dir, MANIFEST_FILE)
+        self.completed = set()
+        self.offsets = {}
+        self.values = {}
+        fileutil.makedirs(log_dir)
+        if resume and os.path.exists(self.filename):
+            self._read()
+            self.f = open(self.filename, 'ab')
+        else:
+            self.f = open(self.filename, 'wb')
+
+    def _read(self):
+        end = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break # partially written entry
+                entry = json.loads(line)
+                run = (entry['grid_point_id'], entry['run_id'])
+                self.completed.add(run)
+                self.offsets.update(entry['offsets'])
+                self.values[run] = entry.get('value')
+                end += len(line)
+
+        # drop the partial entry, if any, so new entries start on a new line
+        with open(self.filename, 'rb+') as f:
+            f.truncate(end)
+
+    def is_complete(self, grid_point_id, run_id):
+        return (grid_point_id, run_id) in self.completed
+
+    def record(self, grid_point_id, run_id, offsets, value=None):
+        """ Record that a run finished with tables written up to `offsets`,
+        and with `value` as its sample of an adaptive sweep's metric.
+        """
+        entry = {'grid_point_id': grid_point_id, 'run_id': run_id,
+                 'offsets': offsets}
+        if value is not None:
+            entry['value'] = value
+        self.f.write(json.dumps(entry) + '\n')
+        self.f.flush()
+        self.completed.add((grid_point_id, run_id))
+        self.offsets.update(offsets)
+        self.values[(grid_point_id, run_id)] = value
+
+    def close(self):
+        self.f.close()
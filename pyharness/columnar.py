@@ -0,0 +1,329 @@
+""" columnar: a binary, column-oriented table format for stat_logger dumps.
+
+    Chosen with `stat_logger.configure(settings={'format': 'columnar'})`.
+    Each table is a directory, `<log_dir>/<table>.cols/`, holding a file of
+    fixed-width values and a null mask for every column, plus an append-only
+    chunk index, `_index.jsonl`. Rows are appended a chunk at a time, and
+    each chunk adds a line to the index with the number of rows committed so
+    far and the name, file and type of every column. Readers trust only the
+    last complete index line, so a table stays readable if a write is
+    interrupted, and `load()` can memory-map each column without copying it.
+
+    Columns are 'bool', 'int64', 'float64' or 'str'. String columns store
+    int64 end offsets into a blob of UTF-8 text. Integer columns widen to
+    float64 when a float is logged to them; any other mix of types is an
+    error. Values of other types (e.g., lists) are stored as JSON strings.
+
+    Requires NumPy.
+"""
+import glob
+import json
+import os
+import shutil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import fileutil
+
+SUFFIX = '.cols'
+
+INDEX_FILE = '_index.jsonl'
+
+DTYPES = {
+    'bool': '?',
+    'int64': '<i8',
+    'float64': '<f8',
+    'str': '<i8', # end offsets into the column's text blob
+}
+
+def table_dirs(log_dir):
+    """ List `(table_name, path)` for each columnar table under `log_dir`. """
+    paths = sorted(glob.glob(os.path.join(log_dir, '*' + SUFFIX)))
+    return [(os.path.basename(path)[:-len(SUFFIX)], path) for path in paths]
+
+def read_index(path):
+    """ Read a table's committed state from its chunk index.
+
+    Returns `(n_rows, columns, end)`, where `columns` is a list of dicts with
+    each column's 'name', 'file' and 'type', and `end` is the byte offset of
+    the end of the last complete index line.
+    """
+    n_rows, columns, end = 0, [], 0
+    try:
+        f = open(os.path.join(path, INDEX_FILE), 'rb')
+    except IOError:
+        return n_rows, columns, end
+    with f:
+        for line in f:
+            if not line.endswith('\n'):
+                break # partially written chunk
+            entry = json.loads(line)
+            n_rows, columns = entry['rows'], entry['columns']
+            end += len(line)
+    return n_rows, columns, end
+
+def rollback(path, n_rows):
+    """ Drop the chunks of a table committed after its first `n_rows` rows.
+
+    The column files are truncated the next time the table is appended to.
+    """
+    index_file = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return
+    keep = 0
+    with open(index_file, 'rb+') as f:
+        for line in f:
+            if not line.endswith('\n') or json.loads(line)['rows'] > n_rows:
+                break
+            keep += len(line)
+        f.truncate(keep)
+
+def load(path):
+    """ Memory-map a table's columns.
+
+    Returns a dict mapping column names to masked arrays, masked where no
+    value was logged. Numeric and boolean columns are views of the files on
+    disk; string columns are decoded into object arrays.
+    """
+    _require_numpy()
+    n_rows, columns, _ = read_index(path)
+    arrays = {}
+    for column in columns:
+        data = _map(path, column['file'] + '.data', DTYPES[column['type']],
+                    n_rows)
+        nulls = _map(path, column['file'] + '.null', '?', n_rows)
+        if column['type'] == 'str':
+            data = np.array(_decode(path, column, data), dtype=object)
+        arrays[column['name']] = np.ma.MaskedArray(data, mask=nulls,
+                                                   copy=False)
+    return arrays
+
+def schema(path):
+    """ Map each column of a table to its type. """
+    return {column['name']: column['type'] for column in read_index(path)[1]}
+
+def iter_tuples(path, column_names, chunk_size=10000, start=0, stop=None):
+    """ Yield each row of a table from row `start` up to row `stop` as a
+    tuple of its values for `column_names`, with None for missing values.
+    """
+    _require_numpy()
+    n_rows, columns, _ = read_index(path)
+    by_name = {column['name']: column for column in columns}
+    last = n_rows if stop is None else min(stop, n_rows)
+    for start in xrange(start, last, chunk_size):
+        stop = min(start + chunk_size, last)
+        values = []
+        for name in column_names:
+            column = by_name.get(name)
+            if column is None:
+                values.append([None] * (stop - start))
+                continue
+            data = _map(path, column['file'] + '.data',
+                        DTYPES[column['type']], n_rows)
+            nulls = _map(path, column['file'] + '.null', '?', n_rows)
+            if column['type'] == 'str':
+                chunk = _decode(path, column, data, start, stop)
+            else:
+                chunk = data[start:stop].tolist()
+            values.append([None if null else v for v, null
+                           in zip(chunk, nulls[start:stop].tolist())])
+        for row in zip(*values):
+            yield row
+
+class ColumnarWriter(object):
+    """ Appends chunks of rows to a columnar table. """
+    def __init__(self, path, append=False):
+        _require_numpy()
+        self.path = path
+        if not append:
+            shutil.rmtree(path, ignore_errors=True)
+        fileutil.makedirs(path)
+        self.n_rows, columns, end = read_index(path)
+        self.columns = [dict(c) for c in columns]
+        self.by_name = {column['name']: column for column in self.columns}
+        self.n_files = 1 + max([int(c['file'][1:]) for c in self.columns]
+                               or [-1])
+        self.n_bytes = 0 # written by this writer
+
+        # drop anything written after the last committed chunk
+        with open(self._file(INDEX_FILE), 'ab') as f:
+            f.truncate(end)
+        for column in self.columns:
+            self._truncate(column)
+
+    def append(self, chunk, n_rows):
+        """ Append a chunk of `n_rows` rows.
+
+        `chunk` maps column names to `(type, values, nulls)`, where `values`
+        and `nulls` are sequences of `n_rows` values and missing-value flags.
+        Columns the table has but `chunk` lacks are filled with nulls.
+        """
+        if not n_rows:
+            return
+        written = set()
+        for name, (column_type, values, nulls) in chunk.iteritems():
+            column = self.by_name.get(name)
+            if column_type is None:
+                continue # all nulls
+            if column is None:
+                column = self._add_column(name, column_type)
+            elif column['type'] != column_type:
+                column_type = self._reconcile(column, column_type)
+            self._write(column, column_type, values, nulls)
+            written.add(name)
+
+        for column in self.columns:
+            if column['name'] not in written:
+                self._write_nulls(column, n_rows)
+
+        self.n_rows += n_rows
+        index_line = json.dumps({'rows': self.n_rows,
+                                 'columns': self.columns}) + '\n'
+        with open(self._file(INDEX_FILE), 'ab') as f:
+            f.write(index_line)
+        self.n_bytes += len(index_line)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _add_column(self, name, column_type):
+        column = {'name': name, 'file': self._new_file(),
+                  'type': column_type}
+        self.columns.append(column)
+        self.by_name[name] = column
+        suffixes = ('.data', '.null', '.str') if column_type == 'str' else (
+            '.data', '.null')
+        for suffix in suffixes:
+            open(self._file(column['file'] + suffix), 'wb').close()
+        self._write_nulls(column, self.n_rows)
+        return column
+
+    def _new_file(self):
+        self.n_files += 1
+        return 'c%d' % (self.n_files - 1)
+
+    def _reconcile(self, column, column_type):
+        # returns the type to write the chunk as
+        if column['type'] == 'float64' and column_type == 'int64':
+            return 'float64'
+        if column['type'] == 'int64' and column_type == 'float64':
+            # widen into new files, since earlier index lines refer to the
+            # integer ones
+            old_file, column['file'] = column['file'], self._new_file()
+            data = np.fromfile(self._file(old_file + '.data'),
+                               dtype=DTYPES['int64'])
+            data.astype(DTYPES['float64']).tofile(
+                self._file(column['file'] + '.data'))
+            shutil.copyfile(self._file(old_file + '.null'),
+                            self._file(column['file'] + '.null'))
+            column['type'] = 'float64'
+            return 'float64'
+        raise ValueError("Inconsistent schema: %s logged with values of type "
+                         "%s and %s!" % (column['name'], column['type'],
+                                         column_type))
+
+    def _write(self, column, column_type, values, nulls):
+        if column_type == 'str':
+            blob_file = self._file(column['file'] + '.str')
+            base = os.path.getsize(blob_file)
+            texts = ['' if v is None else to_text(v) for v in values]
+            texts = [t.encode('utf-8') if isinstance(t, unicode) else t
+                     for t in texts]
+            ends = base + np.cumsum([len(t) for t in texts], dtype='<i8')
+            with open(blob_file, 'ab') as f:
+                f.write(''.join(texts))
+            self.n_bytes += int(ends[-1] - base) if len(ends) else 0
+            data = ends
+        else:
+            data = np.asarray(values)
+            if data.dtype == object:
+                data = np.array([0 if v is None else v for v in values])
+            data = data.astype(DTYPES[column_type])
+        with open(self._file(column['file'] + '.data'), 'ab') as f:
+            data.tofile(f)
+        with open(self._file(column['file'] + '.null'), 'ab') as f:
+            np.asarray(nulls, dtype='?').tofile(f)
+        self.n_bytes += data.nbytes + len(nulls)
+
+    def _write_nulls(self, column, n_rows):
+        if column['type'] == 'str':
+            blob_size = os.path.getsize(self._file(column['file'] + '.str'))
+            data = np.empty(n_rows, dtype='<i8')
+            data.fill(blob_size)
+        else:
+            data = np.zeros(n_rows, dtype=DTYPES[column['type']])
+        with open(self._file(column['file'] + '.data'), 'ab') as f:
+            data.tofile(f)
+        with open(self._file(column['file'] + '.null'), 'ab') as f:
+            np.ones(n_rows, dtype='?').tofile(f)
+        self.n_bytes += data.nbytes + n_rows
+
+    def _truncate(self, column):
+        itemsize = np.dtype(DTYPES[column['type']]).itemsize
+        data_file = self._file(column['file'] + '.data')
+        with open(data_file, 'rb+') as f:
+            f.truncate(self.n_rows * itemsize)
+        with open(self._file(column['file'] + '.null'), 'rb+') as f:
+            f.truncate(self.n_rows)
+        if column['type'] == 'str':
+            ends = _map(self.path, column['file'] + '.data', '<i8',
+                        self.n_rows)
+            with open(self._file(column['file'] + '.str'), 'rb+') as f:
+                f.truncate(int(ends[-1]) if self.n_rows else 0)
+
+def chunk_type(values):
+    """ The column type for a list of Python values (None for missing). """
+    kinds = set()
+    for v in values:
+        if v is None:
+            continue
+        elif isinstance(v, bool):
+            kinds.add('bool')
+        elif isinstance(v, (int, long)):
+            kinds.add('int64')
+        elif isinstance(v, float):
+            kinds.add('float64')
+        else:
+            kinds.add('str')
+    if not kinds:
+        return None
+    if kinds == set(['int64', 'float64']):
+        return 'float64'
+    if len(kinds) > 1:
+        raise ValueError("Inconsistent schema: values of types %s logged to "
+                         "the same column!" % ', '.join(sorted(kinds)))
+    return kinds.pop()
+
+def to_text(value):
+    """ Store a value that isn't a scalar as JSON. """
+    if isinstance(value, basestring):
+        return value
+    return json.dumps(value)
+
+def _map(path, name, dtype, n_rows):
+    if not n_rows:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(os.path.join(path, name), dtype=dtype, mode='r',
+                     shape=(n_rows,))
+
+def _decode(path, column, ends, start=0, stop=None):
+    stop = len(ends) if stop is None else stop
+    if start == stop:
+        return []
+    with open(os.path.join(path, column['file'] + '.str'), 'rb') as f:
+        offset = int(ends[start - 1]) if start else 0
+        f.seek(offset)
+        blob = f.read(int(ends[stop - 1]) - offset)
+    texts = []
+    prev = 0
+    for end in ends[start:stop].tolist():
+        texts.append(blob[prev:end - offset].decode('utf-8'))
+        prev = end - offset
+    return texts
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("The columnar stat_logger format requires NumPy.")
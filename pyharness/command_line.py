@@ -1,6 +1,8 @@
 import os
 import argparse
-from experiment import run_experiment, list_experiments
+import sys
+from experiment import run_experiments, list_experiments
+from profiling import MODES
 
 OUT_DIR = os.path.join(os.path.abspath('.'), 'results')
 
@@ -18,17 +20,41 @@ def main():
             print "\t", exp
         return
 
-    for exp in args.experiments:
-        run_experiment(
-            exp,
-            exp_home=args.exp_home,
-            out_dir=args.outdir,
-            db_name=args.dbname,
-            do_run=not args.plot_only,
-            do_plot=not args.run_only,
-            overwrite=not args.no_overwrite,
-            partition=args.partition
-        )
+    results = run_experiments(
+        args.experiments,
+        jobs=args.jobs,
+        exp_home=args.exp_home,
+        out_dir=args.outdir,
+        db_name=args.dbname,
+        do_run=not args.plot_only,
+        do_plot=not args.run_only,
+        overwrite=not args.no_overwrite,
+        partition=args.partition,
+        workers=args.workers,
+        resume=args.resume,
+        load_jobs=args.load_jobs,
+        pipeline=args.pipeline,
+        index=args.index,
+        timing_file=args.timings,
+        timeout=args.timeout,
+        memory_limit=args.memory_limit,
+        cpu_limit=args.cpu_limit,
+        profile=args.profile,
+        profile_fraction=args.profile_fraction,
+        memoize=args.memoize,
+        role=args.role,
+        lease_timeout=args.lease_timeout
+    )
+
+    if len(results) > 1:
+        print
+        print "Summary:"
+        width = max(len(name) for name, _, _ in results)
+        for name, success, seconds in results:
+            print "\t%-*s  %-6s  %.3f seconds" % (
+                width, name, 'ok' if success else 'FAILED', seconds)
+    if not all(success for _, success, _ in results):
+        sys.exit(1)
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Run experiments on the crowd '
@@ -49,8 +75,74 @@ def parse_args():
     parser.add_argument('--outdir', '-o', default=OUT_DIR,
                         help=('Directory to output data and plots to. '
                               '(defaults to \'./results/\''))
-    parser.add_argument('--partition', '-s', type=int,
-                        help='Partition of the grid to run the experiments on.')
+    parser.add_argument('--partition', '-s', metavar='K/N',
+                        help=('Partition of the grid to run the experiments '
+                              'on, as \'k/N\' for the kth (from 0) of N '
+                              'disjoint partitions.'))
+    parser.add_argument('--workers', '-w', type=int,
+                        help=('Number of processes to run grid points on. '
+                              '(defaults to 1)'))
+    parser.add_argument('--resume', action='store_true',
+                        help=('Resume an interrupted run, skipping grid points '
+                              'that already completed. (defaults to False)'))
+    parser.add_argument('--load-jobs', type=int, default=1,
+                        help=('Number of tables to load into the database '
+                              'concurrently. (defaults to 1)'))
+    parser.add_argument('--pipeline', action='store_true',
+                        help=('Load results into the database in the '
+                              'background while the experiment runs. '
+                              '(defaults to False)'))
+    parser.add_argument('--index', action='store_true',
+                        help=('Index the grid parameters in the database and '
+                              'build a <table>_summary table of per grid '
+                              'point statistics for each table. (defaults to '
+                              'False)'))
+    parser.add_argument('--timings', metavar='PATH',
+                        help=('File of recorded grid point runtimes to '
+                              'schedule and balance partitions with. Every '
+                              'node running a partition must use the same '
+                              'timings. (defaults to a file in the log '
+                              'directory, used for scheduling only)'))
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help=('Kill any run that takes longer than this, log '
+                              'it to the _harness_status table, and move on. '
+                              '(defaults to no limit)'))
+    parser.add_argument('--memory-limit', type=float, metavar='MB',
+                        help=('Limit the address space of each run. (defaults '
+                              'to no limit)'))
+    parser.add_argument('--cpu-limit', type=float, metavar='SECONDS',
+                        help=('Limit the CPU time of each run. (defaults to '
+                              'no limit)'))
+    parser.add_argument('--profile', action='append', choices=MODES,
+                        help=('Profile grid point runs: \'cpu\' with '
+                              'cProfile, \'memory\' for allocations. May be '
+                              'given twice for both. Profiles and a summary '
+                              'are saved to <outdir>/<experiment>/_profiles/.'))
+    parser.add_argument('--profile-fraction', type=float, default=1.0,
+                        metavar='F',
+                        help=('Fraction of runs to profile. (defaults to 1)'))
+    parser.add_argument('--memoize', action='store_true',
+                        help=('Replay the logged rows of runs whose code and '
+                              'parameters haven\'t changed since an earlier '
+                              'sweep instead of running them again. Only for '
+                              'deterministic experiments. (defaults to '
+                              'False)'))
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help=('Number of experiments to run at once, each in '
+                              'its own process. (defaults to 1)'))
+    parser.add_argument('--role', choices=('coordinator', 'worker'),
+                        help=('Share the grid\'s runs out through a lease '
+                              'queue under the output directory: the '
+                              'coordinator publishes the runs, merges the '
+                              'logs and loads the DB, and any number of '
+                              'workers (here, or on hosts sharing the output '
+                              'directory) run them. Start the coordinator '
+                              'first.'))
+    parser.add_argument('--lease-timeout', type=float, default=60.0,
+                        metavar='SECONDS',
+                        help=('Seconds after which a run whose worker stopped '
+                              'renewing its lease is given to another worker. '
+                              '(defaults to 60)'))
     parser.add_argument('--list', '-l', action='store_true',
                         help='List available experiments and exit.')
     group = parser.add_mutually_exclusive_group()
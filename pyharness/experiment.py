@@ -1,61 +1,199 @@
+import ast
 import glob
+import json
+import multiprocessing
 import os
+import sys
 import time
+import traceback
+
+import fileutil
+import instrument
+import param
+import profiling
+
+LIST_CACHE = '.pyharness_experiments.json'
 
 
 def run_experiment(experiment_name, exp_home=None,
                    out_dir=None, db_name=None,
                    do_run=True, do_plot=True, overwrite=True,
-                   partition=None):
+                   partition=None, workers=None, resume=False,
+                   load_jobs=1, pipeline=False, index=False,
+                   timing_file=None, timeout=None, memory_limit=None,
+                   cpu_limit=None, profile=None, profile_fraction=1.0,
+                   memoize=False, role=None, lease_timeout=60.0):
+    """ Run and/or plot an experiment. Returns whether every step succeeded.
+    """
     # Make sure the output directory exists
     out_dir = os.path.abspath(os.path.join(out_dir, experiment_name))
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
+    # Configure the grid for this invocation
+    param.configure(workers=workers, partition=partition, resume=resume,
+                    load_jobs=load_jobs, pipeline=pipeline, index=index,
+                    timing_file=timing_file, timeout=timeout,
+                    memory_limit=memory_limit, cpu_limit=cpu_limit,
+                    profile=profile, profile_fraction=profile_fraction,
+                    profile_dir=os.path.join(out_dir, profiling.PROFILE_DIR),
+                    memoize=memoize, role=role, lease_timeout=lease_timeout)
+
     # Move to the experiment home directory
     try:
         old_dir = os.getcwd()
         os.chdir(exp_home)
+        instrument.hold() # log this experiment's phases to _harness_runs
 
         # Import the module
         try:
-            experiment_module = __import__(experiment_name, globals(), locals(),
-                                           ['run', 'plot'])
+            with instrument.phase('import'):
+                experiment_module = __import__(experiment_name, globals(),
+                                               locals(), ['run', 'plot'])
         except ImportError as e:
             print "Couldn't import module", experiment_name + ":", str(e)
-            return
+            return False
 
         # Run the experiment
+        success = True
         if do_run:
             partition_desc = 'all' if partition is None else str(partition)
             print
             print "Running experiment '%s' on partition '%s'..." % (
                 experiment_name, partition_desc)
-            exec_module_method(
-                experiment_module, 'run', experiment_name, out_dir=out_dir,
-                db_name=db_name, overwrite=overwrite, partition=partition)
+            with instrument.phase('run'):
+                success &= exec_module_method(
+                    experiment_module, 'run', experiment_name,
+                    out_dir=out_dir, db_name=db_name, overwrite=overwrite,
+                    partition=partition)
 
-        # Plot the output
-        if do_plot:
+        # Plot the output (workers leave that to the coordinator)
+        if do_plot and role != 'worker':
             print
             print "Generating plots for experiment:", experiment_name
-            exec_module_method(
-                experiment_module, 'plot', experiment_name, out_dir=out_dir,
-                db_name=db_name)
+            with instrument.phase('plot'):
+                success &= exec_module_method(
+                    experiment_module, 'plot', experiment_name,
+                    out_dir=out_dir, db_name=db_name)
     finally:
+        instrument.close()
         os.chdir(old_dir)
+    return success
+
+
+def run_experiments(experiment_names, jobs=1, **kwargs):
+    """ Run several experiments with `run_experiment(name, **kwargs)`, up to
+    `jobs` at a time.
+
+    With more than one job, each experiment runs in a process of its own
+    (so it gets its own working directory and logger state), and each line
+    it prints is prefixed with its name. Returns `(name, success, seconds)`
+    for each experiment, in order.
+    """
+    if jobs <= 1:
+        results = []
+        for name in experiment_names:
+            start = time.time()
+            success = run_experiment(name, **kwargs)
+            results.append((name, success, time.time() - start))
+        return results
+
+    pending = list(enumerate(experiment_names))
+    running = {} # index -> (process, pipe, start time)
+    results = {}
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                i, name = pending.pop(0)
+                reader, writer = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=_run_job,
+                                               args=(name, kwargs, writer))
+                proc.start()
+                writer.close()
+                running[i] = (proc, reader, time.time())
+
+            time.sleep(0.1)
+            for i, (proc, reader, start) in running.items():
+                if not reader.poll() and proc.is_alive():
+                    continue
+                # poll again, since it may have reported just before exiting
+                success = None
+                if reader.poll():
+                    try:
+                        success = reader.recv()
+                    except EOFError:
+                        pass # died without reporting
+                proc.join()
+                reader.close()
+                if success is None:
+                    print "[%s] exited with code %s" % (experiment_names[i],
+                                                        proc.exitcode)
+                    success = False
+                results[i] = (experiment_names[i], success,
+                              time.time() - start)
+                del running[i]
+    finally:
+        for proc, reader, _ in running.itervalues():
+            proc.terminate()
+            proc.join()
+            reader.close()
+    return [results[i] for i in range(len(experiment_names))]
+
+
+def _run_job(name, kwargs, writer):
+    sys.stdout = PrefixedWriter(sys.stdout, '[%s] ' % name)
+    sys.stderr = PrefixedWriter(sys.stderr, '[%s] ' % name)
+    try:
+        success = run_experiment(name, **kwargs)
+    except BaseException:
+        # including SystemExit and KeyboardInterrupt, so the parent still
+        # hears back
+        traceback.print_exc()
+        success = False
+    sys.stdout.flush()
+    sys.stderr.flush()
+    writer.send(success)
+
+
+class PrefixedWriter(object):
+    """ Writes whole lines to `stream`, each starting with `prefix`, so the
+    output of concurrent processes can be told apart.
+    """
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.partial = ''
+
+    def write(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        if lines:
+            self.stream.write(''.join(self.prefix + line + '\n'
+                                      for line in lines))
+            self.stream.flush()
+
+    def flush(self):
+        if self.partial:
+            self.write('\n')
+        self.stream.flush()
 
 
 def time_exec(method, *args, **kwargs):
+    """ Call `method`, print how long it took, and return whether it
+    succeeded.
+    """
     pre = time.time()
+    success = False
     try:
         method(*args, **kwargs)
+        success = True
     except TypeError as e:
         print "Method's signature is incorrect:", e.message
     except Exception as e:
         print "Error running method:", str(e)
     post = time.time()
     print "Done in %.3f seconds." % (post - pre)
+    return success
 
 
 def exec_module_method(module, method_name, *args, **kwargs):
@@ -66,29 +204,91 @@ def exec_module_method(module, method_name, *args, **kwargs):
             print "doesn't define a '%s' method. Nothing to do." % method_name
         else:
             method(*args, **kwargs)
-    time_exec(_method, *args, **kwargs)
+    return time_exec(_method, *args, **kwargs)
 
 
 def list_experiments(experiment_home):
+    """ Describe each experiment (a module defining `run`) in
+    `experiment_home` as 'name: docstring'.
+
+    Modules are parsed rather than imported, so listing doesn't run them or
+    import their dependencies. What each module defines is cached in
+    `LIST_CACHE` in `experiment_home`, keyed on its size and modification
+    time, so only new or changed modules are parsed.
+    """
+    cache_file = os.path.join(experiment_home, LIST_CACHE)
     try:
-        old_dir = os.getcwd()
-        os.chdir(experiment_home)
-        modules = [
-            os.path.splitext(os.path.basename(filename))[0]
-            for filename in glob.glob('./*.py')
-            if '__init__' not in filename
-        ]
-        output = []
-        for m in modules:
-            description = m + ': '
-            try:
-                module = __import__(m, globals(), locals())
-                if not hasattr(module, 'run'):
-                    continue
-                description += module.__doc__ or '(No Description)'
-            except ImportError as e:
-                description += 'Import Error: ' + str(e)
-            output.append(description)
-    finally:
-        os.chdir(old_dir)
+        with open(cache_file, 'rb') as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+
+    entries = {}
+    output = []
+    for filename in sorted(glob.glob(os.path.join(experiment_home, '*.py'))):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        if '__init__' in name:
+            continue
+        stat = os.stat(filename)
+        entry = cache.get(name)
+        if entry is None or entry['stamp'] != [stat.st_size, stat.st_mtime]:
+            entry = _describe(filename)
+            entry['stamp'] = [stat.st_size, stat.st_mtime]
+        entries[name] = entry
+        if entry['error']:
+            description = name + ': Syntax Error: ' + entry['error']
+        elif entry['run']:
+            description = name + ': ' + (entry['doc'] or '(No Description)')
+        else:
+            continue
+        if isinstance(description, unicode):
+            description = description.encode('utf-8') # read from the cache
+        output.append(description)
+
+    if entries != cache:
+        try:
+            text = json.dumps(entries)
+            with fileutil.atomic_write(cache_file) as f:
+                f.write(text)
+        except (IOError, OSError, ValueError):
+            pass # e.g., a read-only experiment home, or undecodable text
     return output
+
+
+def _describe(filename):
+    # whether a module defines `run` at the top level, and its docstring
+    with open(filename, 'rb') as f:
+        source = f.read()
+    try:
+        tree = ast.parse(source, filename)
+    except (SyntaxError, TypeError) as e:
+        return {'run': False, 'doc': None, 'error': str(e)}
+
+    names = set()
+    for node in _top_level(tree.body):
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    names.add(target.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split('.')[0])
+    return {'run': 'run' in names,
+            'doc': ast.get_docstring(tree, clean=False),
+            'error': None}
+
+
+def _top_level(statements):
+    # statements run at import time, including inside if/try blocks
+    for node in statements:
+        yield node
+        if isinstance(node, (ast.If, ast.TryExcept, ast.TryFinally)):
+            for block in (node.body, getattr(node, 'orelse', []),
+                          getattr(node, 'finalbody', [])):
+                for child in _top_level(block):
+                    yield child
+            for handler in getattr(node, 'handlers', []):
+                for child in _top_level(handler.body):
+                    yield child
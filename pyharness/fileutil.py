@@ -0,0 +1,35 @@
+""" fileutil: writing files that other processes may be reading.
+
+    Workers, supervised runs and concurrent experiments share the harness's
+    files, so directories may be made by another process at any time, and a
+    file must never be seen half-written.
+"""
+from contextlib import contextmanager
+import errno
+import os
+import tempfile
+
+def makedirs(path):
+    """ Make `path` and its parents, unless it already exists. """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+@contextmanager
+def atomic_write(filename):
+    """ Open a temporary file next to `filename` for writing, and rename it
+    to `filename` once the `with` block finishes, so readers only ever see
+    the whole file. The temporary file is removed if the block raises.
+    """
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.rename(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
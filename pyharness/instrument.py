@@ -0,0 +1,159 @@
+""" instrument: where a sweep's time and memory go.
+
+    The harness logs a row to the reserved `_harness_runs` table for every
+    (grid point, run) it executes, with the run's wall-clock and CPU time
+    (including supervised subprocesses), the peak RSS of the process so far,
+    the rows and bytes the run wrote to each table, and the time loggers
+    spent flushing. `run_experiment()` also logs a row for each of its phases
+    ('import', 'run' and 'plot', plus 'finalize' and 'load', which happen
+    during 'run'), with the phase's name in the `phase` column.
+
+    The table is logged and loaded like any other, so it can be queried
+    alongside the results, e.g.:
+
+        SELECT phase, wall_time, cpu_time FROM _harness_runs
+        WHERE phase IS NOT NULL;
+
+    It stays open after the other tables are finalized so the phases that
+    follow can still be logged, and is loaded into the database (on top of
+    what the main load put there) once the experiment is done.
+"""
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import stat_logger
+from stat_loader import to_postgres
+
+RUNS_TABLE = '_harness_runs'
+
+SESSION = {
+    'held': False, # whether `run_experiment()` closes the table
+    'phases': [], # phase rows measured but not logged yet
+    'log_dir': None, # where a grid logged the table, once it finished
+    'db_name': None,
+    'schema_name': None,
+}
+
+class Meter(object):
+    """ Measures the resources used between its creation and `usage()`. """
+    def __init__(self):
+        self.start = time.time()
+        self.start_cpu = _cpu_time()
+        self.start_io = stat_logger.io_stats()
+
+    def usage(self):
+        """ A row of the resources used so far. """
+        row = {'wall_time': time.time() - self.start,
+               'cpu_time': _cpu_time() - self.start_cpu,
+               'peak_rss': _peak_rss()}
+        rows, n_bytes, flush_time = {}, {}, 0.0
+        for table_name, stats in stat_logger.io_stats().iteritems():
+            if table_name == RUNS_TABLE:
+                continue
+            start = self.start_io.get(table_name, (0, 0, 0.0))
+            if stats[:2] != start[:2]:
+                rows[table_name] = stats[0] - start[0]
+                n_bytes[table_name] = stats[1] - start[1]
+            flush_time += stats[2] - start[2]
+        if rows:
+            row['rows'] = rows
+            row['bytes'] = n_bytes
+        row['flush_time'] = flush_time
+        return row
+
+def log_run(meter):
+    """ Log the resources used by the current run, as measured by `meter`
+    (created just before the run started).
+    """
+    _log(meter.usage())
+
+@contextmanager
+def phase(name):
+    """ Measure the phase of an experiment run inside the `with` block. """
+    meter = Meter()
+    try:
+        yield
+    finally:
+        row = meter.usage()
+        row['phase'] = name
+        SESSION['phases'].append(row)
+
+def hold():
+    """ Keep the table open once a grid finishes, for `run_experiment()` to
+    log the rest of its phases to and `close()`.
+    """
+    close()
+    SESSION['held'] = True
+
+def finish_grid(log_dir, db_name, schema_name):
+    """ Called once a grid has finalized and loaded its other tables. """
+    SESSION.update(log_dir=log_dir, db_name=db_name, schema_name=schema_name)
+    _log_phases()
+    if not SESSION['held']:
+        close()
+
+def finalize_logs():
+    """ Finalize every table but this one, which is just flushed. """
+    stat_logger.finalize([table_name for table_name in stat_logger.LOGGERS
+                          if table_name != RUNS_TABLE])
+    if RUNS_TABLE in stat_logger.LOGGERS:
+        stat_logger.flush([RUNS_TABLE])
+
+def close():
+    """ Log any pending phases, finalize the table and load what the grid's
+    load didn't include. Phases measured when no grid has run are dropped.
+    """
+    if SESSION['log_dir'] is not None:
+        _log_phases()
+        logger = stat_logger.LOGGERS.pop(RUNS_TABLE, None)
+        if logger is not None:
+            # the next grid may log to a different directory
+            logger.finalize()
+            logger.close()
+            if SESSION['db_name']:
+                to_postgres(SESSION['log_dir'], SESSION['db_name'],
+                            SESSION['schema_name'], overwrite=False)
+    SESSION.update(held=False, phases=[], log_dir=None, db_name=None,
+                   schema_name=None)
+
+def _log_phases():
+    phases, SESSION['phases'] = SESSION['phases'], []
+    if not phases:
+        return
+
+    # phases aren't part of any grid point, so leave out its parameters
+    defaults = dict(stat_logger.LOGGING_DEFAULTS)
+    stat_logger.LOGGING_DEFAULTS.clear()
+    if 'exp_name' in defaults:
+        stat_logger.LOGGING_DEFAULTS['exp_name'] = defaults['exp_name']
+    try:
+        for row in phases:
+            _log(row)
+    finally:
+        stat_logger.LOGGING_DEFAULTS.clear()
+        stat_logger.LOGGING_DEFAULTS.update(defaults)
+
+def _log(row):
+    stat_logger.requireLoggers(RUNS_TABLE)
+    logger = stat_logger.getLogger(RUNS_TABLE)
+    logger.log(**row)
+    logger.end_row()
+
+def _cpu_time():
+    # user and system time of this process and its finished children
+    return sum(os.times()[:4])
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # bytes on OS X, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,483 @@
+""" lease: a work queue of grid point runs, shared through a directory.
+
+    Static partitions can't adapt when nodes differ in speed or some grid
+    points take much longer than others. Instead, a coordinator can publish
+    every (grid point, run) of a sweep to a queue in
+    `<log_dir>/_harness/queue/`, and any number of workers (on this host, or
+    on others that share `log_dir`) pull tasks from it until none are left:
+
+    - A worker takes a task by creating its lease file (atomically, by
+      hard-linking it into place), and renews the lease (its mtime) while
+      the task runs.
+    - A lease that hasn't been renewed for `lease_timeout` seconds has
+      expired (its worker died, or its run hung), and another worker may
+      take it. Leases are only given up on hung runs if runs have a
+      `timeout`: a run's lease isn't renewed once the run is
+      `lease_timeout` seconds past it.
+    - Each worker logs to its own shard, `<log_dir>/_shards/<worker_id>/`,
+      like `parallel` workers do. A task is complete once its done marker is
+      created (again atomically), recording the worker and the offsets its
+      shard was written up to. If an expired task was finished twice, the
+      later worker's rows are rolled back.
+    - Once every task is complete and every worker has exited, the
+      coordinator merges the shards into the main logs.
+
+    Each sweep the coordinator publishes has an id, which tags its leases,
+    done markers and shards. A worker left over from an earlier sweep stops
+    once it notices the id changed, and whatever it writes is ignored.
+
+    No server is needed: the queue only relies on atomic links and renames.
+    Start the coordinator first, e.g.:
+
+        pyharness -e exp --role coordinator &
+        for i in 1 2 3 4; do pyharness -e exp --role worker & done
+"""
+import errno
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from itertools import islice
+
+import checkpoint
+import fileutil
+import instrument
+import memo
+import parallel
+import stat_logger
+
+QUEUE_DIR = os.path.join('_harness', 'queue')
+
+TASKS_FILE = 'tasks.json'
+
+SWEEP_FILE = 'sweep'
+
+class LeaseQueue(object):
+    def __init__(self, log_dir, lease_timeout=60.0):
+        """ Open the queue of the sweep logged to `log_dir`. Leases expire
+        `lease_timeout` seconds after they were last renewed.
+        """
+        self.path = os.path.join(log_dir, QUEUE_DIR)
+        self.lease_timeout = lease_timeout
+        self.sweep = None # the id of the sweep joined or published
+        self._make_dirs()
+
+    def reset(self):
+        """ Empty the queue, e.g. of an earlier sweep's tasks. """
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._make_dirs()
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def publish(self, tasks, sweep=None):
+        """ Publish `(grid_point_id, run_id)` tasks, to be taken in order, as
+        sweep `sweep` (a new sweep, by default).
+        """
+        self.sweep = sweep or uuid.uuid4().hex[:12]
+        with fileutil.atomic_write(os.path.join(self.path, TASKS_FILE)) as f:
+            json.dump({'sweep': self.sweep,
+                       'tasks': [list(task) for task in tasks]}, f)
+        with fileutil.atomic_write(os.path.join(self.path, SWEEP_FILE)) as f:
+            f.write(self.sweep)
+
+    def current_sweep(self):
+        """ The id of the published sweep, or None if there is none. """
+        try:
+            with open(os.path.join(self.path, SWEEP_FILE), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def load(self):
+        """ Join the published sweep, and return its tasks. Returns None if
+        no sweep is published yet.
+        """
+        sweep = self.current_sweep()
+        try:
+            with open(os.path.join(self.path, TASKS_FILE), 'rb') as f:
+                published = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if sweep is None or published['sweep'] != sweep:
+            return None # being published again
+        self.sweep = sweep
+        return [tuple(task) for task in published['tasks']]
+
+    def done_tasks(self):
+        """ The set of completed tasks. Only lists the done markers. """
+        tasks = set()
+        for name in os.listdir(os.path.join(self.path, 'done')):
+            try:
+                grid_point_id, run_id = name.split('-')
+                tasks.add((int(grid_point_id), int(run_id)))
+            except ValueError:
+                continue # a marker's temporary file
+        return tasks
+
+    def marker(self, task):
+        """ The done marker of `task`, or None if it isn't complete. Markers
+        left by a worker of another sweep are removed.
+        """
+        marker_file = self._file('done', task)
+        try:
+            with open(marker_file, 'rb') as f:
+                marker = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if marker.get('sweep') != self.sweep:
+            _remove(marker_file)
+            return None
+        return marker
+
+    def is_done(self, task):
+        return self.marker(task) is not None
+
+    def acquire(self, worker_id, tasks, done=None):
+        """ Take the lease of the first task in `tasks` that isn't complete
+        or leased (or whose lease expired), and return it. Returns None if
+        there is no such task.
+
+        Tasks found complete are added to the set `done`, if given, so the
+        caller can leave them out next time.
+        """
+        for task in tasks:
+            if done is not None and task in done:
+                continue
+            if self.is_done(task):
+                if done is not None:
+                    done.add(task)
+                continue
+            lease_file = self._file('leases', task)
+            holder = self._holder(worker_id)
+            if self._create(lease_file, holder):
+                if self._taken(task, lease_file):
+                    return task
+                continue
+            try:
+                stat = os.stat(lease_file)
+                with open(lease_file, 'rb') as f:
+                    lease_sweep = f.read().split(' ')[0]
+            except (IOError, OSError):
+                continue # released in the meantime; try it next time
+            if (time.time() - stat.st_mtime <= self.lease_timeout
+                and lease_sweep == self.sweep):
+                continue
+
+            # only one worker can rename the expired lease away. If another
+            # worker replaced it in the meantime, put the new lease back.
+            stale_file = '%s.%s.stale' % (lease_file, worker_id)
+            try:
+                os.rename(lease_file, stale_file)
+            except OSError:
+                continue
+            if os.stat(stale_file).st_ino != stat.st_ino:
+                self._restore(stale_file, lease_file)
+                continue
+            os.remove(stale_file)
+            print "Lease of grid point %d, run %d expired; taking it." % (
+                task[0] + 1, task[1] + 1)
+            if (self._create(lease_file, holder)
+                and self._taken(task, lease_file)):
+                return task
+        return None
+
+    def renew(self, task):
+        try:
+            os.utime(self._file('leases', task), None)
+        except OSError:
+            pass # taken over by another worker
+
+    def release(self, task, worker_id):
+        """ Give up a task's lease, if `worker_id` still holds it. """
+        lease_file = self._file('leases', task)
+        try:
+            with open(lease_file, 'rb') as f:
+                holder = f.read()
+            if holder == self._holder(worker_id):
+                os.remove(lease_file)
+        except (IOError, OSError):
+            pass
+
+    def complete(self, task, marker):
+        """ Mark a task done with `marker`. Returns False if it already was.
+        """
+        marker = dict(marker, grid_point_id=task[0], run_id=task[1],
+                      sweep=self.sweep)
+        return self._create(self._file('done', task), json.dumps(marker))
+
+    def join(self, worker_id):
+        """ Register a running worker (see `live_workers()`). """
+        self.beat(worker_id)
+
+    def beat(self, worker_id):
+        try:
+            with open(os.path.join(self.path, 'workers', worker_id), 'wb'):
+                pass
+        except IOError:
+            pass # the queue is being reset
+
+    def leave(self, worker_id):
+        try:
+            os.remove(os.path.join(self.path, 'workers', worker_id))
+        except OSError:
+            pass
+
+    def live_workers(self):
+        """ The workers that are running, i.e., that have registered and
+        beaten within `lease_timeout` seconds.
+        """
+        workers_dir = os.path.join(self.path, 'workers')
+        live = []
+        for worker_id in os.listdir(workers_dir):
+            try:
+                age = time.time() - os.path.getmtime(
+                    os.path.join(workers_dir, worker_id))
+            except OSError:
+                continue
+            if age <= self.lease_timeout:
+                live.append(worker_id)
+        return live
+
+    def _holder(self, worker_id):
+        # what a lease file holds
+        return '%s %s' % (self.sweep, worker_id)
+
+    def _taken(self, task, lease_file):
+        # workers release a task after completing it, so it may have been
+        # completed since the caller listed the tasks left
+        if self.is_done(task):
+            os.remove(lease_file)
+            return False
+        return True
+
+    def _restore(self, stale_file, lease_file):
+        try:
+            os.link(stale_file, lease_file)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.remove(stale_file)
+
+    def _make_dirs(self):
+        for subdir in ('leases', 'done', 'workers'):
+            fileutil.makedirs(os.path.join(self.path, subdir))
+
+    def _file(self, kind, task):
+        return os.path.join(self.path, kind, '%d-%d' % task)
+
+    def _create(self, filename, text):
+        # create `filename` holding `text`, unless it already exists. Linking
+        # a complete temporary file into place is atomic (even over NFS), so
+        # readers never see a partial file.
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                            suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(text)
+            os.link(tmp_filename, filename)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        finally:
+            os.remove(tmp_filename)
+        return True
+
+def coordinate(queue, tasks, sweep=None, poll_interval=1.0, on_done=None):
+    """ Publish `tasks` to `queue` as sweep `sweep` (see `publish()`) and
+    wait until every one is complete and every worker has exited. Returns
+    the done markers of the tasks.
+
+    `on_done` is called with each task's done marker as it completes.
+    """
+    queue.publish(tasks, sweep)
+    print "Published %d tasks to %s." % (len(tasks), queue.path)
+    task_set = set(tasks)
+    markers = {}
+    while True:
+        # only read the markers that are new since the last poll
+        for task in sorted(queue.done_tasks() & task_set - set(markers)):
+            marker = queue.marker(task)
+            if marker is None:
+                continue
+            markers[task] = marker
+            print "Grid point %d, run %d finished by %s (%d of %d)" % (
+                task[0] + 1, task[1] + 1, marker['worker'], len(markers),
+                len(tasks))
+            if on_done is not None:
+                on_done(marker)
+        if len(markers) >= len(tasks) and not queue.live_workers():
+            return markers
+        time.sleep(poll_interval)
+
+def discard_shards(log_dir, sweep):
+    """ Remove the shards under `log_dir` that aren't from sweep `sweep`. """
+    for shard in parallel.shard_dirs(log_dir):
+        if not os.path.basename(shard).startswith(sweep + '-'):
+            print "Discarding %s, which isn't from this sweep." % shard
+            shutil.rmtree(shard, ignore_errors=True)
+
+def repair_shards(log_dir, markers):
+    """ Record the runs of `markers` in their workers' shard manifests.
+
+    A worker records each run it completes in its shard's manifest right
+    after the run's done marker, so this only matters if it died in between.
+    """
+    by_shard = {}
+    for marker in markers.itervalues():
+        by_shard.setdefault(marker['shard'], []).append(marker)
+    for shard_name, shard_markers in by_shard.iteritems():
+        shard = os.path.join(log_dir, parallel.SHARD_DIR, shard_name)
+        manifest = checkpoint.Manifest(shard, resume=True)
+        for marker in shard_markers:
+            if not manifest.is_complete(marker['grid_point_id'],
+                                        marker['run_id']):
+                manifest.record(marker['grid_point_id'], marker['run_id'],
+                                marker['offsets'], value=marker.get('value'))
+        manifest.close()
+
+def work(func, log_dir, grid_points, lease_timeout=60.0, limits=None,
+         run_cache=None, poll_interval=0.5):
+    """ Run tasks from the queue in `log_dir` until every task is complete.
+
+    `grid_points` maps grid point ids to grid points. `limits` and
+    `run_cache` are used as by `parallel` workers; without a 'timeout' in
+    `limits`, a run that hangs keeps its lease. Returns the number of
+    tasks this worker completed.
+    """
+    queue = LeaseQueue(log_dir, lease_timeout)
+    tasks = queue.load()
+    while tasks is None:
+        time.sleep(poll_interval)
+        tasks = queue.load()
+
+    worker_id = '%s-%d' % (socket.gethostname(), os.getpid())
+    shard_name = '%s-%s' % (queue.sweep, worker_id)
+    shard = os.path.join(log_dir, parallel.SHARD_DIR, shard_name)
+    stat_logger.flush()
+    stat_logger.reset()
+    stat_logger.configure(settings={'log_dir': shard, 'append': True})
+    manifest = checkpoint.Manifest(shard, resume=True)
+
+    queue.join(worker_id)
+    heartbeat = _Heartbeat(queue, worker_id, (limits or {}).get('timeout'))
+    heartbeat.start()
+    n_completed = 0
+    done = set() # tasks known to be complete
+    first = 0 # the tasks before this one are all in `done`
+    try:
+        while _same_sweep(queue):
+            while first < len(tasks) and tasks[first] in done:
+                first += 1
+            if first == len(tasks):
+                break
+            task = queue.acquire(worker_id, islice(tasks, first, None), done)
+            if task is None:
+                time.sleep(poll_interval) # the rest are leased
+                continue
+
+            heartbeat.start_task(task)
+            try:
+                n_completed += _run_task(func, task, grid_points[task[0]],
+                                         queue, worker_id, shard, manifest,
+                                         limits, run_cache)
+            finally:
+                heartbeat.task = None
+                queue.release(task, worker_id)
+            done.add(task)
+    finally:
+        heartbeat.stop()
+        stat_logger.finalize()
+        manifest.close()
+        queue.leave(worker_id)
+    return n_completed
+
+def _run_task(func, task, grid_point, queue, worker_id, shard, manifest,
+              limits, run_cache):
+    grid_point_id, run_id = task
+    print "Running grid point %d, run %d..." % (grid_point_id + 1,
+                                                run_id + 1),
+    start = time.time()
+    before = _positions()
+    stat_logger.configure(defaults=grid_point)
+    stat_logger.configure(defaults={'grid_point_id': grid_point_id,
+                                    'run_id': run_id})
+    meter = instrument.Meter()
+    value, cached = memo.call_run(run_cache, func, grid_point, run_id,
+                                  limits=limits)
+    instrument.log_run(meter)
+    offsets = _positions()
+    elapsed = None if cached else time.time() - start
+    if queue.current_sweep() != queue.sweep:
+        print "the sweep is over; rolling back."
+    elif queue.complete(task, {'worker': worker_id,
+                               'shard': os.path.basename(shard),
+                               'offsets': offsets, 'value': value,
+                               'elapsed': elapsed}):
+        manifest.record(grid_point_id, run_id, offsets, value=value)
+        print "finished in %3f seconds" % (time.time() - start)
+        return 1
+    else:
+        # another worker finished it first, after our lease expired
+        print "already finished by another worker; rolling back."
+    stat_logger.reset()
+    stat_logger.rollback(shard, before)
+    return 0
+
+def _positions():
+    # how far every table in the shard is written, including those not
+    # reopened since the last rollback (which `offsets()` would leave out)
+    positions = stat_logger.offsets()
+    positions.update(memo.positions())
+    return positions
+
+def _same_sweep(queue):
+    # whether the sweep the worker joined is still the published one
+    sweep = queue.current_sweep()
+    if sweep is not None and sweep != queue.sweep:
+        print "Sweep %s was replaced by sweep %s." % (queue.sweep, sweep)
+        return False
+    return sweep == queue.sweep
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+class _Heartbeat(threading.Thread):
+    """ Renews a worker's registration and its current task's lease, until
+    the task runs `lease_timeout` seconds past the run `timeout`, if any.
+    """
+    def __init__(self, queue, worker_id, timeout=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.task = None
+        self.deadline = None
+        self.stopped = threading.Event()
+
+    def start_task(self, task):
+        if self.timeout:
+            self.deadline = (time.time() + self.timeout
+                             + self.queue.lease_timeout)
+        self.task = task
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_timeout / 4.0):
+            self.queue.beat(self.worker_id)
+            task, deadline = self.task, self.deadline
+            if task is not None and (deadline is None
+                                     or time.time() < deadline):
+                self.queue.renew(task)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
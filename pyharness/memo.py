@@ -0,0 +1,152 @@
+""" memo: replay the rows of runs that were already computed.
+
+    With memoization on (`ParamGrid.run(memoize=True)`, or `pyharness
+    --memoize`), the rows each (grid point, run) logs are stored under
+    `<log_dir>/_harness/memo/`, keyed on a hash of the source of the module
+    defining the run function, the grid point's parameters, the run id, the
+    grid's seed and the logging format. When a later sweep reaches a run with
+    the same key, its rows are logged again (with the current logging
+    defaults, e.g. the current `grid_point_id`) instead of calling the
+    function. So adding a value to one axis of a grid only computes the new
+    points, and editing the experiment's module invalidates everything.
+
+    Only use it for run functions that are deterministic given their
+    parameters, `run_id` and seed. Rows logged to the harness's own tables
+    aren't stored, and runs that fail under `supervise` aren't cached.
+"""
+import hashlib
+import inspect
+import json
+import marshal
+import os
+
+import columnar
+import fileutil
+import stat_logger
+import supervise
+
+MEMO_DIR = os.path.join('_harness', 'memo')
+
+HARNESS_PREFIX = '_harness'
+
+class RunCache(object):
+    def __init__(self, directory, func, seed=0):
+        """ Store the rows of runs of `func` under `directory`. """
+        self.directory = directory
+        self.code = code_digest(func)
+        self.seed = seed
+        fileutil.makedirs(directory)
+
+    def call(self, func, grid_point, run_id, tracker=None, limits=None):
+        """ Replay the current run if it's cached, and otherwise run it with
+        `supervise.call_run()` and cache its rows.
+
+        Returns the run's sample for `tracker` and whether it was cached.
+        """
+        filename = self._filename(grid_point, run_id)
+        try:
+            with open(filename, 'rb') as f:
+                rows = json.load(f)
+        except (IOError, ValueError):
+            pass # not cached, or unreadable
+        else:
+            replay(rows)
+            return (tracker.end_run() if tracker else None), True
+
+        start = positions()
+        value = supervise.call_run(func, grid_point, tracker, limits)
+        rows = captured(start, positions())
+        if rows is not None:
+            with fileutil.atomic_write(filename) as f:
+                json.dump(rows, f)
+        return value, False
+
+    def _filename(self, grid_point, run_id):
+        key = json.dumps([self.code, grid_point, run_id, self.seed,
+                          stat_logger.LOGGING_CONFIG.get('format')],
+                         sort_keys=True, default=repr)
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + '.json')
+
+def call_run(cache, func, grid_point, run_id, tracker=None, limits=None):
+    """ Run the current run through `cache`, or straight through
+    `supervise.call_run()` if `cache` is None. Returns `(value, cached)`.
+    """
+    if cache is None:
+        return supervise.call_run(func, grid_point, tracker, limits), False
+    return cache.call(func, grid_point, run_id, tracker, limits)
+
+def code_digest(func):
+    """ A hash of the source of the module defining `func` (or of its
+    bytecode, if the source can't be found).
+    """
+    while hasattr(func, 'func') and not hasattr(func, 'func_code'):
+        func = func.func # a functools.partial
+    try:
+        with open(inspect.getsourcefile(func), 'rb') as f:
+            source = f.read()
+    except (TypeError, IOError):
+        source = marshal.dumps(func.func_code)
+    return hashlib.sha1(source).hexdigest()
+
+def positions():
+    """ Map each table logged under the current log directory to how far
+    it is written: a byte offset for JSON tables, or a row count for
+    columnar ones.
+    """
+    stat_logger.flush()
+    log_dir = stat_logger.LOGGING_CONFIG['log_dir']
+    table_positions = {}
+    for table_name, filename in stat_logger.table_files(log_dir):
+        table_positions[table_name] = os.path.getsize(filename)
+    for table_name, path in columnar.table_dirs(log_dir):
+        table_positions[table_name] = columnar.read_index(path)[0]
+    return table_positions
+
+def captured(start, end):
+    """ The `(table_name, row)` pairs logged between two `positions()`,
+    without the logging defaults, or None if the run failed.
+    """
+    log_dir = stat_logger.LOGGING_CONFIG['log_dir']
+    defaults = stat_logger.LOGGING_DEFAULTS
+    if end.get(supervise.STATUS_TABLE) != start.get(supervise.STATUS_TABLE):
+        return None
+
+    rows = []
+    for table_name, filename in stat_logger.table_files(log_dir):
+        if (table_name.startswith(HARNESS_PREFIX)
+            or end[table_name] == start.get(table_name)):
+            continue
+        with open(filename, 'rb') as f:
+            f.seek(start.get(table_name, 0))
+            text = f.read(end[table_name] - start.get(table_name, 0))
+        for raw_line in text.splitlines():
+            raw_row = raw_line.strip('[],\n')
+            if raw_row:
+                rows.append((table_name, _without(json.loads(raw_row),
+                                                  defaults)))
+
+    for table_name, path in columnar.table_dirs(log_dir):
+        if (table_name.startswith(HARNESS_PREFIX)
+            or end[table_name] == start.get(table_name)):
+            continue
+        names = sorted(columnar.schema(path))
+        for values in columnar.iter_tuples(path, names,
+                                           start=start.get(table_name, 0),
+                                           stop=end[table_name]):
+            row = dict((name, value) for name, value in zip(names, values)
+                       if value is not None)
+            rows.append((table_name, _without(row, defaults)))
+    return rows
+
+def replay(rows):
+    """ Log `(table_name, row)` pairs as `captured()` returned them. """
+    for table_name, row in rows:
+        stat_logger.requireLoggers(table_name)
+        logger = stat_logger.getLogger(table_name)
+        logger.log(**row)
+        logger.end_row()
+
+def _without(row, defaults):
+    return dict((key, value) for key, value in row.iteritems()
+                if key not in defaults)
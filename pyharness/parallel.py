@@ -0,0 +1,188 @@
+""" parallel: run grid point tasks across a pool of worker processes.
+
+    Each worker is forked from the harness process, so it inherits the
+    experiment's loggers and defaults, but logs to its own shard directory
+    (`<log_dir>/_shards/<worker_id>`). Once every task is done the shards are
+    merged back into the normal `<table>.json` files with
+    `stat_logger.absorb()`.
+
+    Each shard keeps its own checkpoint manifest, so an interrupted parallel
+    sweep can be resumed from its shards. Once merged, a shard's runs are
+    recorded in the main manifest and the shard is deleted.
+"""
+import multiprocessing
+import os
+import Queue
+import shutil
+import time
+import traceback
+
+import checkpoint
+import instrument
+import memo
+import stat_logger
+
+SHARD_DIR = '_shards'
+
+def shard_dirs(log_dir):
+    """ List the worker shard directories under `log_dir`. """
+    root = os.path.join(log_dir, SHARD_DIR)
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root))]
+
+def resume_shards(log_dir, merged=()):
+    """ Roll every shard under `log_dir` back to its last completed run.
+
+    Shards with runs in `merged` (the runs in the main manifest) were merged
+    before the sweep was interrupted, and are deleted.
+
+    Returns a dict mapping each `(grid_point_id, run_id)` completed across
+    the remaining shards to its recorded value (see
+    `checkpoint.Manifest.record()`).
+    """
+    completed = {}
+    for shard in shard_dirs(log_dir):
+        manifest = checkpoint.Manifest(shard, resume=True)
+        manifest.close()
+        if manifest.completed & set(merged):
+            shutil.rmtree(shard)
+            continue
+        stat_logger.rollback(shard, manifest.offsets)
+        completed.update(manifest.values)
+    return completed
+
+def merge_shards(log_dir, manifest):
+    """ Append every shard under `log_dir` to this process's loggers, record
+    their runs in `manifest`, and delete them.
+    """
+    runs = {}
+    for shard in shard_dirs(log_dir):
+        stat_logger.absorb(shard)
+        shard_manifest = checkpoint.Manifest(shard, resume=True)
+        shard_manifest.close()
+        runs.update(shard_manifest.values)
+
+    offsets = stat_logger.offsets()
+    for (grid_point_id, run_id), value in sorted(runs.iteritems()):
+        manifest.record(grid_point_id, run_id, offsets, value=value)
+    shutil.rmtree(os.path.join(log_dir, SHARD_DIR), ignore_errors=True)
+
+def run_tasks(func, tasks, n_workers, log_dir, resume=False, tracker=None,
+              on_done=None, limits=None, run_cache=None):
+    """ Call `func` for each `(grid_point_id, grid_point, run_id)` in `tasks`
+    on `n_workers` processes.
+
+    If `tracker` (an `adaptive.MetricTracker`) is given, workers record each
+    run's sample of its metric. `on_done`, if given, is called with the
+    `grid_point_id`, `run_id`, sample and elapsed time (None if it was
+    replayed from `run_cache`) of each finished task, and returns a list of
+    further tasks to run. `limits` are passed to `supervise.call_run()` for
+    each task, through `run_cache` if it is given (see `memo`).
+
+    Unless `resume` is set, shards from earlier sweeps are deleted first.
+    Returns the shard directories the workers logged to. Raises a
+    RuntimeError if any task fails or a worker dies.
+    """
+    if not resume:
+        shutil.rmtree(os.path.join(log_dir, SHARD_DIR), ignore_errors=True)
+
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    n_tasks = len(tasks)
+    n_workers = min(n_workers, n_tasks) or 1
+
+    # workers inherit our loggers, so don't leave them rows to write twice
+    stat_logger.flush()
+
+    procs = [multiprocessing.Process(target=_worker,
+                                     args=(k, func, log_dir, task_queue,
+                                           result_queue, tracker, limits,
+                                           run_cache))
+             for k in range(n_workers)]
+    for p in procs:
+        p.start()
+
+    try:
+        n_done = 0
+        n_exited = 0
+        stopped = False
+        while n_exited < n_workers:
+            # once every task is done, no more can be added
+            if not stopped and n_done == n_tasks:
+                for _ in range(n_workers):
+                    task_queue.put(None)
+                stopped = True
+
+            try:
+                result = result_queue.get(timeout=1)
+            except Queue.Empty:
+                # a worker that dies takes its task with it, and tasks that
+                # depend on that one would never be queued
+                if any(p.exitcode not in (None, 0) for p in procs):
+                    raise RuntimeError("A worker process died with %d of %d "
+                                       "tasks unfinished."
+                                       % (n_tasks - n_done, n_tasks))
+                continue
+
+            if result[0] == 'done':
+                _, grid_point_id, run_id, elapsed, value = result
+                n_done += 1
+                print "Grid point %d, run %d" % (grid_point_id + 1,
+                                                 run_id + 1),
+                if elapsed is None:
+                    print "replayed from the run cache",
+                else:
+                    print "finished in %3f seconds" % elapsed,
+                print "(%d of %d)" % (n_done, n_tasks)
+                if on_done is not None:
+                    for task in on_done(grid_point_id, run_id, value,
+                                        elapsed):
+                        task_queue.put(task)
+                        n_tasks += 1
+            elif result[0] == 'error':
+                _, grid_point_id, run_id, tb = result
+                raise RuntimeError("Grid point %d, run %d failed:\n%s"
+                                   % (grid_point_id + 1, run_id + 1, tb))
+            else:
+                n_exited += 1
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+    return shard_dirs(log_dir)
+
+def _worker(worker_id, func, log_dir, task_queue, result_queue,
+            tracker=None, limits=None, run_cache=None):
+    shard = os.path.join(log_dir, SHARD_DIR, str(worker_id))
+    stat_logger.reset()
+    stat_logger.configure(settings={'log_dir': shard, 'append': True})
+    manifest = checkpoint.Manifest(shard, resume=True)
+    if tracker is not None:
+        tracker.end_run() # drop anything collected before the fork
+
+    for grid_point_id, grid_point, run_id in iter(task_queue.get, None):
+        start = time.time()
+        try:
+            stat_logger.configure(defaults=grid_point)
+            stat_logger.configure(defaults={'grid_point_id': grid_point_id,
+                                            'run_id': run_id})
+            meter = instrument.Meter()
+            value, cached = memo.call_run(run_cache, func, grid_point,
+                                          run_id, tracker, limits)
+            instrument.log_run(meter)
+            manifest.record(grid_point_id, run_id, stat_logger.offsets(),
+                            value=value)
+        except Exception:
+            result_queue.put(('error', grid_point_id, run_id,
+                              traceback.format_exc()))
+            return
+        elapsed = None if cached else time.time() - start
+        result_queue.put(('done', grid_point_id, run_id, elapsed, value))
+
+    stat_logger.finalize()
+    result_queue.put(('exit', worker_id))
@@ -1,67 +1,594 @@
 import copy
+import os
 import random
 import time
-from itertools import product
+from itertools import islice, product
 
+import adaptive
+import checkpoint
+import instrument
+import lease
+import memo
+import parallel
+import profiling
 import stat_logger
-from stat_loader import to_postgres
+import timing
+from stat_loader import BackgroundLoader, HARNESS_COLUMNS, to_postgres
+
+GRID_CONFIG = {
+    'workers': None,
+    'partition': None,
+    'resume': False,
+    'load_jobs': 1,
+    'pipeline': False,
+    'index': False,
+    'timing_file': None,
+
+    # per-run limits; runs are supervised in subprocesses if any is set
+    'timeout': None, # seconds of wall-clock time
+    'memory_limit': None, # megabytes
+    'cpu_limit': None, # seconds of CPU time
+
+    # profile modes (see `profiling`), the fraction of runs to profile, and
+    # where to save the profiles (defaults to `<log_dir>/_profiles/`)
+    'profile': None,
+    'profile_fraction': 1.0,
+    'profile_dir': None,
+
+    # replay the rows of runs computed by earlier sweeps (see `memo`)
+    'memoize': False,
+
+    # 'coordinator' or 'worker' to share the sweep's runs out through a
+    # lease queue (see `lease`), and how long a lease lasts without renewal
+    'role': None,
+    'lease_timeout': 60.0,
+}
+
+def run_limits(timeout=None, memory_limit=None, cpu_limit=None):
+    """ Per-run limits for `supervise.call_run()`, defaulting to
+    `GRID_CONFIG`'s.
+    """
+    limits = {'timeout': timeout, 'memory_limit': memory_limit,
+              'cpu_limit': cpu_limit}
+    for key, value in limits.items():
+        if value is None:
+            limits[key] = GRID_CONFIG[key]
+    return limits
+
+def configure(**settings):
+    """ Set harness-wide defaults for ParamGrid (e.g., from the command line).
+    """
+    GRID_CONFIG.update(**settings)
+
+def parse_partition(partition, n_partitions=None):
+    """ Parse a partition spec into a `(partition, n_partitions)` pair.
+
+    `partition` is either an index (with `n_partitions` given) or a 'k/N'
+    string. Partitions are numbered from 0.
+    """
+    if isinstance(partition, basestring) and '/' in partition:
+        partition, n_partitions = partition.split('/', 1)
+    if n_partitions is None:
+        raise ValueError("Partition %s given without a number of partitions. "
+                         "Use a 'k/N' spec." % partition)
+    partition, n_partitions = int(partition), int(n_partitions)
+    if not 0 <= partition < n_partitions:
+        raise ValueError("Partition %d is out of range for %d partitions."
+                         % (partition, n_partitions))
+    return partition, n_partitions
+
+def assign_partitions(point_ids, costs, n_partitions):
+    """ Split `point_ids` into `n_partitions` lists with balanced total cost.
+
+    Points are assigned greedily, most expensive first, to the partition with
+    the least cost so far. Ties are broken by the order of `point_ids`, so the
+    assignment is deterministic.
+    """
+    order = sorted(range(len(point_ids)),
+                   key=lambda pos: (-costs[point_ids[pos]], pos))
+    shards = [[] for _ in range(n_partitions)]
+    loads = [0.0] * n_partitions
+    for pos in order:
+        k = min(range(n_partitions), key=lambda k: (loads[k], k))
+        shards[k].append(point_ids[pos])
+        loads[k] += costs[point_ids[pos]]
+    return shards
 
 class ParamGrid(object):
-    def __init__(self, experiment_name, log_dir, overwrite=True, **params):
+    def __init__(self, experiment_name, log_dir, overwrite=True,
+                 partition=None, n_partitions=None, seed=0, cost=None,
+                 resume=None, timing_file=None, role=None, **params):
         """ A grid of parameters to run experiments on.
 
         `log_dir` is the directory to dump raw data to.
 
+        `partition` and `n_partitions` restrict the grid to the `partition`th
+        of `n_partitions` disjoint shards (`partition` may also be a 'k/N'
+        string). Every node computes the same shards and `grid_point_id`s, so
+        N nodes can each run one shard with no coordination and load their
+        output into the same schema. Defaults to `GRID_CONFIG['partition']`.
+
+        `seed` fixes the order grid points are run in and how they are
+        assigned to partitions.
+
+        `cost` is an optional function from a grid point to its estimated
+        cost. Points are run most expensive first, and partitions are balanced
+        by cost.
+
+        `timing_file` is where the runtime of each grid point is recorded
+        (defaults to `GRID_CONFIG['timing_file']`, or
+        `<log_dir>/_harness/timings.json`).
+        Without a `cost`, points with recorded runtimes are run longest first.
+        Since every node must compute the same partitions, recorded runtimes
+        only balance partitions if `timing_file` is given explicitly, and it
+        must then hold the same timings on every node (e.g., a copy from an
+        earlier sweep). Otherwise partitions are balanced by count.
+
+        `resume` continues an interrupted sweep logged to the same `log_dir`:
+        runs recorded in the checkpoint manifest are skipped, and rows logged
+        after the last completed run are dropped before new rows are appended.
+        Defaults to `GRID_CONFIG['resume']`.
+
+        `role` is 'coordinator' or 'worker' to run the grid through a lease
+        queue shared with other processes (see `lease` and `run()`). Defaults
+        to `GRID_CONFIG['role']`.
+
         `params` is a set of parameters of the form
         `param_name=[val1, val2, ...]`.
         """
         self.experiment_name = experiment_name
-        grid_axes = [[(k, val) for val in params[k]] for k in params.iterkeys()]
-        self.parameters = params.keys()
-        self.grid_points = [dict(p) for p in product(*grid_axes)]
-        random.shuffle(self.grid_points)
+        self.parameters = sorted(params.iterkeys())
+        grid_axes = [[(k, val) for val in params[k]] for k in self.parameters]
+        all_points = [dict(p) for p in product(*grid_axes)]
+
+        # grid point ids are positions in the full product, so they are stable
+        # across nodes and partitions. Only the run order is shuffled.
+        point_ids = range(len(all_points))
+        random.Random(seed).shuffle(point_ids)
+
+        if timing_file is None:
+            timing_file = GRID_CONFIG['timing_file']
+        self.timings = timing.TimingStore(
+            timing_file or os.path.join(log_dir, timing.TIMING_FILE))
+        estimate = cost or self.timings.estimator()
+
+        if partition is None:
+            partition = GRID_CONFIG['partition']
+        if partition is not None:
+            partition, n_partitions = parse_partition(partition, n_partitions)
+            shared_cost = cost or (timing_file and estimate)
+            costs = [shared_cost(p) if shared_cost else 1.0
+                     for p in all_points]
+            shards = assign_partitions(point_ids, costs, n_partitions)
+            owned = set(shards[partition])
+            point_ids = [i for i in point_ids if i in owned]
+            print "Running partition %d of %d (%d of %d grid points)" % (
+                partition, n_partitions, len(point_ids), len(all_points))
+
+        if estimate:
+            # longest first, to keep expensive points out of the tail. The
+            # sort is stable, so ties keep their shuffled order.
+            point_ids.sort(key=lambda i: -estimate(all_points[i]))
+
+        self.grid_point_ids = point_ids
+        self.grid_points = [all_points[i] for i in point_ids]
         self.n_points = len(self.grid_points)
         self.log_dir = log_dir
+        self.seed = seed
         self.overwrite = overwrite
-        stat_logger.configure(settings={'log_dir': log_dir},
+        self.resume = GRID_CONFIG['resume'] if resume is None else resume
+        self.role = GRID_CONFIG['role'] if role is None else role
+        if self.role not in (None, 'coordinator', 'worker'):
+            raise ValueError("Unknown role: %s" % self.role)
+        if self.role == 'worker':
+            # workers only log to their shards; the coordinator owns the logs
+            self.manifest = None
+        else:
+            self.manifest = checkpoint.Manifest(log_dir, resume=self.resume)
+        if self.resume and self.manifest is not None:
+            print "Resuming: %d runs already completed." % (
+                len(self.manifest.completed))
+            stat_logger.rollback(log_dir, self.manifest.offsets)
+        stat_logger.configure(settings={'log_dir': log_dir,
+                                        'append': self.resume},
                               defaults={'exp_name': self.experiment_name})
 
-    def run(self, func, n_runs=1, db_name=None):
+    def run(self, func, n_runs=1, db_name=None, workers=None, pipeline=None,
+            metric=None, ci_width=None, min_runs=3, timeout=None,
+            memory_limit=None, cpu_limit=None, profile=None,
+            profile_fraction=None, memoize=None):
         """ Run a function on a grid of parameter settings and log output.
 
         `func` is a function that takes a StatLogger and a value for each of
         `self.parameters`, and logs statistics generated during its execution
         to the logger.
 
+        `workers` is the number of processes to spread (grid point, run) tasks
+        over (defaults to `GRID_CONFIG['workers']`, or 1).
+
+        `pipeline` loads logged rows into `db_name` in the background as runs
+        complete, rather than all at once at the end (defaults to
+        `GRID_CONFIG['pipeline']`). Only serial runs are pipelined.
+
+        `metric` turns on adaptive replication. It is a `(table_name,
+        column)` pair naming a logged value. Each run's sample is the mean of
+        the values it logs, and a grid point stops getting new runs once it
+        has at least `min_runs` samples and the 95% confidence interval of
+        their mean is at most `ci_width` wide. `n_runs` is then the most runs
+        any grid point gets.
+
+        `timeout` (seconds), `memory_limit` (megabytes) and `cpu_limit`
+        (seconds of CPU time) limit each run, and default to `GRID_CONFIG`'s.
+        If any is set, each run is supervised in its own process. A run that
+        times out, is killed, or raises is logged to the `_harness_status`
+        table and the sweep moves on (see `supervise`).
+
+        `profile` is a profile mode or a list of them ('cpu' and 'memory',
+        see `profiling`) to profile a sampled `profile_fraction` of runs in.
+        Both default to `GRID_CONFIG`'s. The profiles are saved to
+        `GRID_CONFIG['profile_dir']` and summarized once the sweep is done.
+
+        `memoize` replays the rows of runs that an earlier sweep already
+        computed with the same code and parameters instead of running them
+        again (defaults to `GRID_CONFIG['memoize']`; see `memo`).
+
+        With a `role`, the runs are shared out through a lease queue instead
+        (see `lease`): the coordinator publishes every run that isn't complete
+        yet, waits for worker processes (on this host, or on others sharing
+        `log_dir`) to finish them, then merges their logs and loads
+        `db_name`. Workers take runs until none are left and load nothing.
+        `workers`, `pipeline` and `metric` don't apply.
+
         After executing this function, `self.logger` will have persisted stats
         to the filesystem.
         """
+        if workers is None:
+            workers = GRID_CONFIG['workers']
+        if pipeline is None:
+            pipeline = GRID_CONFIG['pipeline']
+        limits = run_limits(timeout, memory_limit, cpu_limit)
+        run_cache = self._run_cache(func, memoize)
+        if profile is None:
+            profile = GRID_CONFIG['profile']
+        profile_dir = None
+        if profile:
+            if profile_fraction is None:
+                profile_fraction = GRID_CONFIG['profile_fraction']
+            profile_dir = (GRID_CONFIG['profile_dir']
+                           or os.path.join(self.log_dir, profiling.PROFILE_DIR))
+            if not self.resume:
+                profiling.clear(profile_dir)
+            modes = [profile] if isinstance(profile, basestring) else profile
+            func = profiling.profiled(func, modes, profile_fraction,
+                                      profile_dir)
+        if self.role is not None:
+            if (workers and workers > 1) or metric is not None:
+                print ("Worker processes and adaptive replication don't "
+                       "apply to a %s; ignoring them." % self.role)
+            if self.role == 'worker':
+                n_completed = lease.work(
+                    func, self.log_dir,
+                    dict(zip(self.grid_point_ids, self.grid_points)),
+                    lease_timeout=GRID_CONFIG['lease_timeout'],
+                    limits=limits, run_cache=run_cache)
+                print "Worker done: completed %d runs." % n_completed
+                return
+            self._run_coordinated(n_runs)
+            self._finish(db_name)
+            self._summarize_profiles(profile_dir)
+            return
 
-        for i, grid_point in enumerate(self.grid_points):
+        convergence = None
+        if metric is not None:
+            table_name, column = metric
+            convergence = adaptive.Convergence(table_name, column, ci_width,
+                                               min_runs=min_runs)
+            convergence.watch()
+        loader = None
+        try:
+            if workers and workers > 1:
+                if db_name and pipeline:
+                    print ("Parallel runs aren't pipelined; loading the DB "
+                           "after the sweep instead.")
+                self._run_parallel(func, n_runs, workers, convergence,
+                                   limits=limits, run_cache=run_cache)
+            else:
+                if db_name and pipeline:
+                    loader = BackgroundLoader(self.log_dir, db_name,
+                                              self.experiment_name,
+                                              overwrite=self.overwrite)
+                self._run_serial(func, n_runs, loader, convergence,
+                                 limits=limits, run_cache=run_cache)
+        finally:
+            if convergence is not None:
+                convergence.unwatch()
+        if convergence is not None:
+            n_converged = len([grid_point_id for grid_point_id
+                               in self.grid_point_ids
+                               if convergence.converged(grid_point_id)])
+            print "%d of %d grid points converged." % (n_converged,
+                                                       self.n_points)
+        self._finish(db_name, loader)
+        self._summarize_profiles(profile_dir)
+
+    def search(self, func, objective, eta=2, rounds=None, min_budget=1,
+               budget_param=None, minimize=False, db_name=None, workers=None,
+               timeout=None, memory_limit=None, cpu_limit=None,
+               memoize=None):
+        """ Search the grid for the best points by successive halving.
+
+        Every grid point is first run with a small budget. After each round,
+        only the best `1/eta` of the points (by `objective`) are kept, and the
+        survivors are run again with `eta` times the budget, until one point
+        is left or `rounds` rounds have run. Returns the grid points left
+        after the last round, best first.
+
+        `objective` is a `(table_name, column)` pair naming a logged value,
+        which is maximized (or minimized, if `minimize` is set). Each run's
+        sample is the mean of the values it logs.
+
+        In round `r`, the budget is `min_budget * eta ** r`. By default the
+        budget is a number of runs, and points are ranked by the mean of all
+        their runs so far. If `budget_param` is given, the budget is instead
+        passed to `func` as that keyword argument (e.g., a number of
+        iterations), each point is run once per round, and points are ranked
+        by that run alone.
+
+        Rows are logged with a 'round' default, and run ids continue from one
+        round to the next. `func`, `db_name`, `workers`, the limits and
+        `memoize` are as in `run()`.
+        """
+        if self.role is not None:
+            raise ValueError("search() can't run as a %s; rounds depend on "
+                             "the results of the last." % self.role)
+        if workers is None:
+            workers = GRID_CONFIG['workers']
+        limits = run_limits(timeout, memory_limit, cpu_limit)
+        run_cache = self._run_cache(func, memoize)
+        table_name, column = objective
+        survivors = zip(self.grid_point_ids, self.grid_points)
+        first_run = 0
+        round_id = 0
+        defaults = dict(stat_logger.LOGGING_DEFAULTS)
+        try:
+            while True:
+                budget = min_budget * eta ** round_id
+                n_runs = 1 if budget_param else int(budget)
+                if budget_param:
+                    points = [(grid_point_id, dict(grid_point,
+                                                   **{budget_param: budget}))
+                              for grid_point_id, grid_point in survivors]
+                else:
+                    points = survivors
+                if round_id == 0 or budget_param:
+                    tracker = adaptive.MetricTracker(table_name, column)
+
+                print "Round %d: running %d grid points with budget %s..." % (
+                    round_id + 1, len(points), budget)
+                stat_logger.configure(defaults={'round': round_id})
+                tracker.watch()
+                try:
+                    if workers and workers > 1:
+                        self._run_parallel(func, n_runs, workers, tracker,
+                                           points=points, first_run=first_run,
+                                           limits=limits, run_cache=run_cache)
+                    else:
+                        self._run_serial(func, n_runs, tracker=tracker,
+                                         points=points, first_run=first_run,
+                                         limits=limits, run_cache=run_cache)
+                finally:
+                    tracker.unwatch()
+                first_run += n_runs
+                round_id += 1
+
+                # rank the survivors, putting points that logged nothing last
+                sign = 1 if minimize else -1
+                order = sorted(range(len(survivors)), key=lambda pos: (
+                    tracker.mean(survivors[pos][0]) is None,
+                    sign * (tracker.mean(survivors[pos][0]) or 0), pos))
+                survivors = [survivors[pos] for pos in order]
+                if len(survivors) <= 1 or round_id == rounds:
+                    break
+                survivors = survivors[:max(len(survivors) // eta, 1)]
+        finally:
+            # don't tag later runs with the last round
+            stat_logger.LOGGING_DEFAULTS.clear()
+            stat_logger.LOGGING_DEFAULTS.update(defaults)
+
+        print "Best grid point: %s (mean %s: %s)" % (
+            survivors[0][1], column, tracker.mean(survivors[0][0]))
+        self._finish(db_name)
+        return [grid_point for _, grid_point in survivors]
+
+    def _run_cache(self, func, memoize=None):
+        if memoize is None:
+            memoize = GRID_CONFIG['memoize']
+        if not memoize:
+            return None
+        return memo.RunCache(os.path.join(self.log_dir, memo.MEMO_DIR), func,
+                             seed=self.seed)
+
+    def _summarize_profiles(self, profile_dir):
+        if profile_dir is not None:
+            summary = profiling.summarize(profile_dir)
+            if summary:
+                print "Profile summary written to", summary
+
+    def _finish(self, db_name, loader=None):
+        print "Finalizing logs..."
+        with instrument.phase('finalize'):
+            instrument.finalize_logs()
+        print "Done!"
+        if loader is not None:
+            with instrument.phase('load'):
+                print "Waiting for the background DB load to catch up..."
+                loader.close()
+                print "Loaded %d rows in the background." % loader.n_rows
+                # picks up wherever the background load stopped or failed
+                self.save_to_db(db_name, overwrite=False)
+        elif db_name:
+            with instrument.phase('load'):
+                self.save_to_db(db_name)
+        instrument.finish_grid(self.log_dir, db_name, self.experiment_name)
+
+    def _run_serial(self, func, n_runs, loader=None, tracker=None,
+                    points=None, first_run=0, limits=None, run_cache=None):
+        if points is None:
+            points = zip(self.grid_point_ids, self.grid_points)
+        for i, (grid_point_id, grid_point) in enumerate(points):
             grid_start = time.time()
-            print "Running grid point %d of %d..." % (i+1, self.n_points)
+            print "Running grid point %d of %d..." % (i+1, len(points))
 
             stat_logger.configure(defaults=grid_point)
-            stat_logger.configure(defaults={'grid_point_id': i})
-            for j in range(n_runs):
+            stat_logger.configure(defaults={'grid_point_id': grid_point_id})
+            for j in range(first_run, first_run + n_runs):
+                if tracker and tracker.converged(grid_point_id):
+                    print "Converged after %d runs (CI width %g)." % (
+                        tracker.n_samples(grid_point_id),
+                        tracker.ci_width(grid_point_id))
+                    break
+                if self.manifest.is_complete(grid_point_id, j):
+                    print "Run %d of %d already completed." % (
+                        j+1, first_run + n_runs)
+                    if tracker:
+                        tracker.add(grid_point_id,
+                                    self.manifest.values[(grid_point_id, j)])
+                    continue
                 run_start = time.time()
-                print "Run %d of %d..." % (j+1, n_runs),
+                print "Run %d of %d..." % (j+1, first_run + n_runs),
                 stat_logger.configure(defaults={'run_id': j})
-                func(**grid_point)
+                meter = instrument.Meter()
+                value, cached = memo.call_run(run_cache, func, grid_point, j,
+                                              tracker, limits)
+                instrument.log_run(meter)
+                if cached:
+                    print "replayed from the run cache,",
+                else:
+                    self.timings.record(grid_point, time.time() - run_start)
+                offsets = stat_logger.offsets()
+                self.manifest.record(grid_point_id, j, offsets, value=value)
+                if tracker:
+                    tracker.add(grid_point_id, value)
+                if loader is not None:
+                    loader.submit(offsets, stat_logger.column_types())
                 run_end = time.time()
                 print "finished in %3f seconds" % (run_end - run_start)
             grid_end = time.time()
             print ("Grid point %d finished in %3f seconds"
                    % (i+1, grid_end - grid_start))
+            self.timings.save()
 
-        print "Finalizing logs..."
-        stat_logger.finalize()
-        print "Done!"
-        if db_name:
-            self.save_to_db(db_name)
+    def _run_parallel(self, func, n_runs, workers, tracker=None, points=None,
+                      first_run=0, limits=None, run_cache=None):
+        if points is None:
+            points = zip(self.grid_point_ids, self.grid_points)
+        completed = dict(self.manifest.values)
+        if self.resume:
+            resumed = parallel.resume_shards(self.log_dir,
+                                             merged=self.manifest.completed)
+            print "Resuming: %d runs already completed." % len(resumed)
+            completed.update(resumed)
+
+        grid_points = dict(points)
+        remaining = {} # grid point id -> iterator over run ids left to run
+        in_flight = {} # grid point id -> runs queued but not finished
+        tasks = []
+        for grid_point_id, grid_point in points:
+            run_ids = []
+            for j in range(first_run, first_run + n_runs):
+                if (grid_point_id, j) not in completed:
+                    run_ids.append(j)
+                elif tracker:
+                    tracker.add(grid_point_id, completed[(grid_point_id, j)])
+            remaining[grid_point_id] = iter(run_ids)
+
+            # adaptive sweeps start with enough runs to reach min_runs, then
+            # add one run whenever a run finishes without converging
+            n_first = len(run_ids)
+            if isinstance(tracker, adaptive.Convergence):
+                n_first = 0 if tracker.converged(grid_point_id) else max(
+                    tracker.min_runs - tracker.n_samples(grid_point_id), 1)
+            first_tasks = [(grid_point_id, grid_point, j) for j
+                           in islice(remaining[grid_point_id], n_first)]
+            in_flight[grid_point_id] = len(first_tasks)
+            tasks.extend(first_tasks)
+
+        def on_done(grid_point_id, run_id, value, elapsed):
+            if elapsed is not None:
+                self.timings.record(grid_points[grid_point_id], elapsed)
+            in_flight[grid_point_id] -= 1
+            if not tracker:
+                return []
+            tracker.add(grid_point_id, value)
+            if tracker.converged(grid_point_id):
+                return []
+
+            # top up to min_runs counting the runs still in flight (e.g.
+            # after a failed run), then wait for them before adding more
+            n_more = 0 if in_flight[grid_point_id] else 1
+            if isinstance(tracker, adaptive.Convergence):
+                n_more = max(tracker.min_runs - in_flight[grid_point_id]
+                             - tracker.n_samples(grid_point_id), n_more)
+            more = [(grid_point_id, grid_points[grid_point_id], j)
+                    for j in islice(remaining[grid_point_id], n_more)]
+            in_flight[grid_point_id] += len(more)
+            return more
 
-    def save_to_db(self, db_name):
+        print "Running %d tasks on %d workers..." % (len(tasks), workers)
+        try:
+            parallel.run_tasks(func, tasks, workers, self.log_dir,
+                               resume=self.resume, tracker=tracker,
+                               on_done=on_done, limits=limits,
+                               run_cache=run_cache)
+        finally:
+            self.timings.save()
+
+        print "Merging worker logs..."
+        parallel.merge_shards(self.log_dir, self.manifest)
+
+    def _run_coordinated(self, n_runs):
+        queue = lease.LeaseQueue(self.log_dir, GRID_CONFIG['lease_timeout'])
+        # a resumed sweep keeps its id, so its workers' output stays valid.
+        # Other sweeps' shards are discarded once their workers are gone.
+        sweep = queue.current_sweep() if self.resume else None
+        if not self.resume:
+            queue.reset()
+        grid_points = dict(zip(self.grid_point_ids, self.grid_points))
+        tasks = [(grid_point_id, j) for grid_point_id in self.grid_point_ids
+                 for j in range(n_runs)
+                 if not self.manifest.is_complete(grid_point_id, j)]
+
+        def on_done(marker):
+            if marker.get('elapsed') is not None:
+                self.timings.record(grid_points[marker['grid_point_id']],
+                                    marker['elapsed'])
+
+        try:
+            markers = lease.coordinate(queue, tasks, sweep=sweep,
+                                       on_done=on_done)
+        finally:
+            self.timings.save()
+
+        print "Merging worker logs..."
+        lease.discard_shards(self.log_dir, queue.sweep)
+        lease.repair_shards(self.log_dir, markers)
+        parallel.resume_shards(self.log_dir, merged=self.manifest.completed)
+        parallel.merge_shards(self.log_dir, self.manifest)
+        queue.remove()
+
+    def save_to_db(self, db_name, overwrite=None):
+        """ Load the logs into `db_name`. If `GRID_CONFIG['index']` is set,
+        the grid parameters and harness columns are indexed and each table
+        is summarized by grid point.
+        """
         print "Persisting logs to DB...",
+        if overwrite is None:
+            overwrite = self.overwrite
+        index_columns = summarize_by = None
+        if GRID_CONFIG['index']:
+            index_columns = HARNESS_COLUMNS + self.parameters
+            summarize_by = ['grid_point_id'] + self.parameters
         to_postgres(self.log_dir, db_name, self.experiment_name,
-                    overwrite=self.overwrite)
+                    overwrite=overwrite, jobs=GRID_CONFIG['load_jobs'],
+                    index_columns=index_columns, summarize_by=summarize_by)
         print "Done!"
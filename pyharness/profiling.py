@@ -0,0 +1,189 @@
+""" profiling: opt-in profiles of sampled grid point runs.
+
+    `ParamGrid.run(profile=...)` (or `pyharness --profile`) wraps the run
+    function so a sampled `fraction` of (grid point, run) pairs are profiled.
+    Which runs are sampled depends only on their ids, so it is the same for
+    every worker and every invocation. Each sampled run saves its profile to
+    `<profile_dir>/<grid_point_id>-<run_id>.*`:
+
+    'cpu' profiles with cProfile to a `.prof` file, readable with `pstats`.
+
+    'memory' records what the run allocated and didn't free to a `.mem.json`
+    file. With `tracemalloc` (Python 3, or the pytracemalloc backport) that's
+    the growth in memory by source line. Without it, it's the growth in live
+    objects by type (from `gc`) and in the process's RSS.
+
+    Once the sweep is done, `summarize()` merges every profile into
+    `<profile_dir>/summary.txt`, listing the hottest functions and the
+    largest allocation sites across the whole sweep.
+"""
+import cProfile
+import gc
+import glob
+import hashlib
+import json
+import os
+import pstats
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import fileutil
+import stat_logger
+
+PROFILE_DIR = '_profiles'
+
+MODES = ('cpu', 'memory')
+
+SUMMARY_FILE = 'summary.txt'
+
+def profiled(func, modes, fraction, directory):
+    """ Wrap `func` so the sampled runs (see above) are profiled in each of
+    `modes` and saved under `directory`.
+
+    The grid point and run are read from the logger defaults when the
+    wrapper is called, so it works in worker and supervised processes too.
+    """
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError("Unknown profile mode(s): %s"
+                         % ', '.join(sorted(unknown)))
+    def wrapper(**grid_point):
+        grid_point_id = stat_logger.LOGGING_DEFAULTS.get('grid_point_id')
+        run_id = stat_logger.LOGGING_DEFAULTS.get('run_id')
+        if not sampled(grid_point_id, run_id, fraction):
+            return func(**grid_point)
+        fileutil.makedirs(directory)
+        prefix = os.path.join(directory, '%s-%s' % (grid_point_id, run_id))
+        call = lambda: func(**grid_point)
+        if 'memory' in modes:
+            inner = call
+            call = lambda: _profile_memory(inner, prefix + '.mem.json')
+        if 'cpu' in modes:
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(call)
+            finally:
+                profiler.dump_stats(prefix + '.prof')
+        return call()
+    return wrapper
+
+def sampled(grid_point_id, run_id, fraction):
+    """ Whether to profile a run. Deterministic in the run's ids. """
+    if fraction >= 1:
+        return True
+    digest = hashlib.md5('%s-%s' % (grid_point_id, run_id)).hexdigest()
+    return int(digest[:8], 16) < fraction * 0x100000000
+
+def clear(directory):
+    """ Remove the profiles of an earlier sweep. """
+    for pattern in ('*.prof', '*.mem.json', SUMMARY_FILE):
+        for filename in glob.glob(os.path.join(directory, pattern)):
+            os.remove(filename)
+
+def summarize(directory, top=30):
+    """ Merge every profile in `directory` into its summary file, and return
+    the summary file's name (None if there are no profiles).
+    """
+    cpu_files = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    memory_files = sorted(glob.glob(os.path.join(directory, '*.mem.json')))
+    if not cpu_files and not memory_files:
+        return None
+
+    filename = os.path.join(directory, SUMMARY_FILE)
+    with open(filename, 'wb') as f:
+        if cpu_files:
+            f.write("CPU: %d profiled runs, hottest functions by own time\n"
+                    % len(cpu_files))
+            stats = pstats.Stats(*cpu_files, stream=f)
+            stats.sort_stats('tottime').print_stats(top)
+            f.write("\nHottest functions by cumulative time\n")
+            stats.sort_stats('cumulative').print_stats(top)
+        if memory_files:
+            _summarize_memory(memory_files, f, top)
+    return filename
+
+def _summarize_memory(filenames, f, top):
+    growth = {} # where -> [bytes, count]
+    rss_growth = []
+    for filename in filenames:
+        with open(filename, 'rb') as profile:
+            report = json.load(profile)
+        for where, size, count in report['growth']:
+            total = growth.setdefault(where, [0, 0])
+            total[0] += size or 0
+            total[1] += count or 0
+        if report.get('rss_growth') is not None:
+            rss_growth.append(report['rss_growth'])
+
+    f.write("Memory: %d profiled runs (%s), largest growth\n" % (
+        len(filenames), report['source']))
+    if rss_growth:
+        f.write("RSS growth per run: mean %d bytes, max %d bytes\n" % (
+            sum(rss_growth) / len(rss_growth), max(rss_growth)))
+    f.write("%14s %10s  %s\n" % ('bytes', 'count', 'where'))
+    largest = sorted(growth.iteritems(),
+                     key=lambda item: (-item[1][0], -item[1][1]))
+    for where, (size, count) in largest[:top]:
+        f.write("%14d %10d  %s\n" % (size, count, where))
+
+def _profile_memory(call, filename):
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            return call()
+        finally:
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            growth = [[str(stat.traceback), stat.size_diff, stat.count_diff]
+                      for stat in after.compare_to(before, 'lineno')
+                      if stat.size_diff > 0]
+            _write_report(filename, 'tracemalloc', growth, peak=peak)
+
+    gc.collect()
+    before = _type_counts()
+    rss_before = _rss()
+    try:
+        return call()
+    finally:
+        gc.collect()
+        counts = _type_counts()
+        growth = [[name, None, count - before.get(name, 0)]
+                  for name, count in counts.iteritems()
+                  if count > before.get(name, 0)]
+        rss_after = _rss()
+        rss_growth = (rss_after - rss_before
+                      if None not in (rss_before, rss_after) else None)
+        _write_report(filename, 'gc', growth, rss_growth=rss_growth)
+
+def _write_report(filename, source, growth, peak=None, rss_growth=None):
+    growth.sort(key=lambda item: (-(item[1] or 0), -item[2]))
+    with open(filename, 'wb') as f:
+        json.dump({'source': source, 'growth': growth, 'peak': peak,
+                   'rss_growth': rss_growth}, f)
+
+def _type_counts():
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+def _rss():
+    # current resident set size, where /proc has it
+    if resource is None:
+        return None
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return None
@@ -1,15 +1,168 @@
 """ stat_loader: a utility for loading log dumps and writing them to postgres.
 """
-import glob
 import json
+import multiprocessing
 import os
+import Queue
+import socket
+from StringIO import StringIO
 from sqlalchemy import Table, Column, MetaData, types, create_engine, Sequence
 from sqlalchemy.engine import reflection
 from sqlalchemy.schema import DropSchema, CreateSchema
 import sys
+import threading
+import time
+import traceback
 
-def to_postgres(dump_directory, db_name, schema_name, overwrite=True):
+import columnar
+from stat_logger import read_dump_id, read_schema, table_files
+
+WATERMARK_TABLE = '_pyharness_watermarks'
+
+HARNESS_COLUMNS = ['grid_point_id', 'run_id']
+
+SUMMARY_SUFFIX = '_summary'
+
+SUMMARY_STATS = [
+    ('count', 'count'),
+    ('mean', 'avg'),
+    ('std', 'stddev_samp'),
+    ('min', 'min'),
+    ('max', 'max'),
+]
+
+def to_postgres(dump_directory, db_name, schema_name, overwrite=True,
+                method='copy', jobs=1, retries=2, index_columns=None,
+                summarize_by=None):
+    """ Load every table dumped to `dump_directory` into `schema_name`.
+
+    Both JSON (`<table>.json`) and columnar (`<table>.cols/`) dumps are
+    loaded.
+
+    `method` is 'copy' to stream rows through PostgreSQL's COPY, or 'insert'
+    to insert them in batches with SQLAlchemy.
+
+    Unless `overwrite` is set, tables that already exist are appended to,
+    starting from where their last load left off (see `read_watermarks`).
+
+    `jobs` is the number of tables to load concurrently, each in its own
+    process with its own connection, since parsing the rows is as much work
+    as copying them. A table that fails to load is retried up to `retries`
+    times without affecting the others; if any table still fails, a
+    RuntimeError is raised once the rest are loaded.
+
+    Once loaded, each table gets an index on each of `index_columns` that it
+    has (see `index_table`), and a summary table grouped by `summarize_by`
+    (see `summarize_table`).
+    """
     db = create_engine("postgresql://localhost/" + db_name)
+    existing_tables = prepare_schema(db, schema_name, overwrite)
+    watermarks = read_watermarks(db, schema_name)
+    tables = table_files(dump_directory) + columnar.table_dirs(dump_directory)
+
+    loads = [(schema_name, table_name, filename, table_name in existing_tables,
+              overwrite, method,
+              watermarks.get((table_name, dump_identity(filename))), retries)
+             for table_name, filename in tables]
+
+    pool = None
+    if jobs > 1:
+        db.dispose() # the pool's processes open their own connections
+        pool = multiprocessing.Pool(jobs, _init_process, (db_name,))
+    try:
+        failed = _run_jobs(pool, db, _load_with_retries, loads)
+        loaded = [table_name for table_name, _ in tables
+                  if table_name not in failed]
+        if index_columns or summarize_by:
+            failed += _run_jobs(pool, db, _build,
+                                [(schema_name, table_name, index_columns,
+                                  summarize_by) for table_name in loaded])
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    failed = [table_name for table_name in failed if table_name]
+    if failed:
+        raise RuntimeError("Failed to load tables: %s" % ', '.join(failed))
+
+def _load_with_retries(db, schema_name, table_name, filename, exists,
+                       overwrite, method, watermark, retries):
+    """ Load one table for `to_postgres`, retrying it if it fails. Returns
+    `table_name` if it still failed, or None.
+    """
+    for attempt in range(retries + 1):
+        try:
+            start = time.time()
+            n_rows = load_table(db, schema_name, table_name, filename, exists,
+                                overwrite=overwrite, method=method,
+                                watermark=watermark)
+            elapsed = time.time() - start
+            print ("Loaded %d rows into %s in %.3f seconds "
+                   "(%.0f rows/sec)" % (n_rows, table_name, elapsed,
+                                        n_rows / max(elapsed, 1e-9)))
+            sys.stdout.flush()
+            return None
+        except Exception as e:
+            print "Error loading table %s (attempt %d of %d): %s" % (
+                table_name, attempt + 1, retries + 1, e)
+            sys.stdout.flush()
+            if exists and method != 'copy':
+                break # a partial insert can't be retried safely
+    return table_name
+
+def _build(db, schema_name, table_name, index_columns, summarize_by):
+    """ Index and summarize one loaded table for `to_postgres`. Returns
+    `table_name` if that failed, or None.
+    """
+    try:
+        if index_columns:
+            index_table(db, schema_name, table_name, index_columns)
+        if summarize_by:
+            summarize_table(db, schema_name, table_name, summarize_by)
+    except Exception as e:
+        print "Error indexing or summarizing table %s: %s" % (table_name, e)
+        sys.stdout.flush()
+        return table_name
+    return None
+
+_PROCESS = {} # the engine of a `to_postgres` pool process
+
+def _init_process(db_name):
+    _PROCESS['db'] = create_engine("postgresql://localhost/" + db_name)
+
+def _run_job(job):
+    """ Run one `to_postgres` job in a pool process, returning its result
+    along with what it printed, for the parent to print in one piece.
+    """
+    func, args = job
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        result = func(_PROCESS['db'], *args)
+    finally:
+        output, sys.stdout = sys.stdout.getvalue(), stdout
+    return result, output
+
+def _run_jobs(pool, db, func, jobs):
+    """ Run `func` on each of `jobs`, with `db`, or in `pool`'s processes if
+    there is one, printing each job's output and the progress as it
+    finishes. Returns the results.
+    """
+    if not pool:
+        return [func(db, *args) for args in jobs]
+    results = []
+    for result, output in pool.imap_unordered(_run_job,
+                                              [(func, args) for args in jobs]):
+        results.append(result)
+        sys.stdout.write(output)
+        print "(%d of %d tables done)" % (len(results), len(jobs))
+        sys.stdout.flush()
+    return results
+
+def prepare_schema(db, schema_name, overwrite=True):
+    """ Create `schema_name`, dropping it first if `overwrite` is set.
+    Returns the set of tables already in it.
+    """
     inspector = reflection.Inspector.from_engine(db)
 
     # Drop and recreate the schema
@@ -28,87 +181,610 @@ def to_postgres(dump_directory, db_name, schema_name, overwrite=True):
         print "Schema exists, not creating..."
         sys.stdout.flush()
 
-    # Load the schema if necessary
-    for filename in glob.glob(os.path.join(dump_directory, '*.json')):
-        table_name = os.path.splitext(os.path.basename(filename))[0]
+    existing_tables = set(inspector.get_table_names(schema=schema_name))
+    existing_tables.discard(WATERMARK_TABLE)
+    print "Tables: %s" % sorted(existing_tables)
+    return existing_tables
+
+class BackgroundLoader(object):
+    """ Loads tables into the DB on a background thread while they are still
+    being logged, so little is left to load once an experiment finishes.
 
-        table_names = inspector.get_table_names(schema=schema_name)
-        print "Tables: %s" % table_names
-        table_exists = table_name in table_names
-        if overwrite and table_exists:
-            print "Table exists and overwrite requested. Dropping table %s..." % table_name
+    `submit()` queues the offsets tables have been committed up to, as
+    returned by `stat_logger.offsets()`, and the thread loads each table's
+    rows up to its offset, picking up from its watermark. The column types
+    the logger tracked (`stat_logger.column_types()`) can be submitted too,
+    so the new rows are only parsed once, to be copied. The thread keeps
+    each table and its watermark between loads. At most
+    `max_pending` submissions wait in the queue; past that, `submit()` blocks
+    until the thread catches up, so a slow DB holds the experiment back
+    instead of piling up work. Waiting submissions are merged into one load.
+
+    If a load fails, the error is reported (as `error`, too) and the loader
+    stops loading: later submissions are dropped, and their rows are left
+    for a final `to_postgres` (which picks up from the watermarks) to load.
+    """
+    def __init__(self, dump_directory, db_name, schema_name, overwrite=True,
+                 method='copy', max_pending=16):
+        self.dump_directory = dump_directory
+        self.schema_name = schema_name
+        self.method = method
+        self.db = create_engine("postgresql://localhost/" + db_name)
+        self.existing_tables = prepare_schema(self.db, schema_name, overwrite)
+        self.watermarks = read_watermarks(self.db, schema_name)
+        self.loaded = {} # table name -> what `load_table` kept for it
+        self.queue = Queue.Queue(max_pending)
+        self.error = None
+        self.reported = False
+        self.n_rows = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, offsets, column_types=None):
+        """ Queue a load of every table up to its offset in `offsets`.
+        `column_types` maps tables to the types of their columns, if known.
+        """
+        if self.error is not None:
+            self._report()
+            return
+        self.queue.put((dict(offsets), dict(column_types or {})))
+
+    def close(self):
+        """ Wait for every submitted load to finish. """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            self._report()
+
+    def _report(self):
+        if not self.reported:
+            self.reported = True
+            print ("Background DB load failed; the rest will be loaded after "
+                   "the sweep.\n" + self.error)
             sys.stdout.flush()
-            table.drop(db, checkfirst=True)
-            table_exists = False
 
-        if not table_exists:
-            print "No existing table. Creating table %s..." % table_name
+    def _run(self):
+        done = False
+        while not done:
+            offsets, column_types = {}, {}
+            submitted = self.queue.get()
+            while True:
+                if submitted is None:
+                    done = True
+                    break
+                offsets.update(submitted[0])
+                column_types.update(submitted[1])
+                try:
+                    submitted = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+
+            # after a failure, drain what was queued before submit() saw it
+            if offsets and self.error is None:
+                try:
+                    self._load(offsets, column_types)
+                except Exception:
+                    self.error = traceback.format_exc()
+
+    def _load(self, offsets, column_types):
+        filenames = dict(table_files(self.dump_directory) +
+                         columnar.table_dirs(self.dump_directory))
+        for table_name, offset in sorted(offsets.iteritems()):
+            if table_name not in filenames:
+                continue
+            loaded = self.loaded.setdefault(table_name, {})
+            self.n_rows += load_table(
+                self.db, self.schema_name, table_name, filenames[table_name],
+                table_name in self.existing_tables, overwrite=False,
+                method=self.method,
+                watermark=loaded.get('watermark', self.watermarks.get(
+                    (table_name, dump_identity(filenames[table_name])))),
+                end=offset, columns=column_types.get(table_name),
+                loaded=loaded)
+            self.existing_tables.add(table_name)
+
+def index_table(db, schema_name, table_name, columns):
+    """ Index each of `columns` that `table_name` has, unless it already is.
+    """
+    preparer = db.dialect.identifier_preparer
+    table = reflect_table(db, schema_name, table_name)
+    for column in columns:
+        if column not in table.columns:
+            continue
+        print "Indexing %s.%s..." % (table_name, column)
+        sys.stdout.flush()
+        db.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+            preparer.quote('%s_%s_idx' % (table_name, column)),
+            preparer.format_table(table), preparer.quote(column)))
+
+def summarize_table(db, schema_name, table_name, group_by):
+    """ Rebuild `<table_name>_summary`, which has a row for each group of
+    rows in `table_name` with the same values of `group_by`.
+
+    For each numeric column, the summary has the non-null count, mean,
+    standard deviation, min and max as `<column>_count`, `<column>_mean`,
+    etc., and `n_rows` counts the rows in each group. Tables without any of
+    the `group_by` columns aren't summarized.
+    """
+    preparer = db.dialect.identifier_preparer
+    table = reflect_table(db, schema_name, table_name)
+    group_by = [column for column in group_by if column in table.columns]
+    if not group_by:
+        return
+    numeric = [column.name for column in table.columns
+               if sql_type_name(column.type) in ('INTEGER', 'FLOAT')
+               and column.name not in group_by
+               and column.name not in ['id'] + HARNESS_COLUMNS]
+
+    groups = ', '.join(preparer.quote(column) for column in group_by)
+    selects = [groups, 'count(*) AS n_rows']
+    for column in numeric:
+        for stat, func in SUMMARY_STATS:
+            selects.append('%s(%s) AS %s' % (
+                func, preparer.quote(column),
+                preparer.quote('%s_%s' % (column, stat))))
+    summary = Table(table_name + SUMMARY_SUFFIX, MetaData(),
+                    schema=schema_name)
+
+    print "Summarizing table %s..." % table_name
+    sys.stdout.flush()
+    with db.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS %s'
+                     % preparer.format_table(summary))
+        conn.execute('CREATE TABLE %s AS SELECT %s FROM %s GROUP BY %s' % (
+            preparer.format_table(summary), ', '.join(selects),
+            preparer.format_table(table), groups))
+
+def read_watermarks(db, schema_name):
+    """ Read how far each table in `schema_name` has been loaded from its
+    dump, creating the table of watermarks if it doesn't exist.
+
+    Returns a dict mapping `(table_name, dump_id)` to `(position, n_rows)`,
+    where `dump_id` identifies the dump (see `dump_identity`), `position` is
+    the `DumpReader` position the last load from it stopped at, and `n_rows`
+    is the number of rows loaded from it up to there. A table loaded from
+    several dumps (e.g., by each node of a partitioned sweep, or by a later
+    sweep) has a watermark for each.
+    """
+    table = watermark_table(schema_name)
+    table.create(db, checkfirst=True)
+    return {(table_name, dump_id): (position, n_rows)
+            for table_name, dump_id, position, n_rows
+            in db.execute(table.select())}
+
+def watermark_table(schema_name):
+    return Table(WATERMARK_TABLE, MetaData(),
+                 Column('table_name', types.String, primary_key=True),
+                 Column('dump_id', types.String, primary_key=True),
+                 Column('dump_position', types.BigInteger),
+                 Column('n_rows', types.BigInteger),
+                 schema=schema_name)
+
+def load_table(db, schema_name, table_name, filename, table_exists,
+               overwrite=True, method='copy', watermark=None, end=None,
+               columns=None, loaded=None):
+    """ Load the table dumped to `filename` into `schema_name`, creating it
+    if it doesn't exist (or if `overwrite` is set). Returns the number of
+    rows loaded.
+
+    If the table exists, only the rows dumped after its `watermark` for this
+    dump (as read by `read_watermarks`) are loaded, and any new columns they
+    have are added to it. Rows are loaded up to the `DumpReader` position
+    `end`, or to the end of the dump. The new watermark is committed along
+    with the rows when loading with COPY.
+
+    The types of the table's columns are taken from `columns` (a dict of
+    column types, as in schema sidecars) if given, then from the sidecar,
+    and are otherwise inferred from the rows to load.
+
+    Callers that load the same table repeatedly can pass a dict as
+    `loaded`. The table and its new watermark are kept in it under 'table'
+    and 'watermark', and the table isn't inspected from the DB again.
+    """
+    if overwrite and table_exists:
+        print "Table exists and overwrite requested. Dropping table %s..." % table_name
+        sys.stdout.flush()
+        Table(table_name, MetaData(), schema=schema_name).drop(
+            db, checkfirst=True)
+        table_exists = False
+
+    start, loaded_rows = 0, 0
+    if table_exists and watermark is not None:
+        start, loaded_rows = watermark
+        if start > dump_size(filename):
+            print ("Dump of table %s is smaller than what was loaded from it. "
+                   "Loading all of it..." % table_name)
+            start, loaded_rows = 0, 0
+        elif start == (dump_size(filename) if end is None else end):
+            print "Table %s is up to date." % table_name
+            return 0
+
+    if not table_exists:
+        print "No existing table. Creating table %s..." % table_name
+        sys.stdout.flush()
+
+        schema = (schema_from_columns(columns) if columns is not None
+                  else schema_from_sidecar(filename))
+        if schema is not None:
+            print "Using logged schema for table %s." % table_name
+        else:
+            print "Loading schema for table %s..." % table_name
             sys.stdout.flush()
+            schema = scan_schema(filename, end=end)
+        sys.stdout.flush()
 
-            print "Loading schema for table %s...  " % table_name,
+        # create the table, replacing any left by a failed attempt
+        metadata = MetaData()
+        table = Table(table_name, metadata,
+                      Column('id', types.Integer,
+                             Sequence(table_name + '_id_seq',
+                                      schema=schema_name),
+                             primary_key=True),
+                      *sorted(schema.values(), key=lambda c: c.name),
+                      schema=schema_name)
+        table.drop(db, checkfirst=True)
+        table.create(db)
+        schema_keys = sorted(schema.keys())
+    else:
+        table = loaded.get('table') if loaded is not None else None
+        if table is None:
+            print "Table %s exists. Inspecting from the database..." % (
+                table_name)
             sys.stdout.flush()
-            schema = {}
-            with open(filename, 'rb') as f:
-                for (i, raw_line) in enumerate(f):
-                    if i % 10000 == 0:
-                        print ".",
-                        sys.stdout.flush()
+            table = reflect_table(db, schema_name, table_name)
+
+        # rows logged since the last load may have new columns
+        schema = (schema_from_columns(columns) if columns is not None
+                  else schema_from_sidecar(filename))
+        if schema is None:
+            schema = scan_schema(filename, start, end)
+        if add_columns(db, table, schema):
+            table = reflect_table(db, schema_name, table_name)
+        schema_keys = [c.name for c in table.columns if c.name != 'id']
+
+    # insert the data
+    if start:
+        print "Inserting the new data into table %s..." % table_name
+    else:
+        print "Inserting the data into table %s..." % table_name
+    sys.stdout.flush()
+    reader = DumpReader(filename, start, end)
+    rows = reader.tuples(schema_keys)
+    dump_id = dump_identity(filename)
+    def record_watermark(cursor):
+        set_watermark(db, cursor, schema_name, table_name, dump_id,
+                      reader.position, loaded_rows + reader.n_rows)
+    if method == 'copy':
+        copy_rows(db, table, schema_keys, rows, before_commit=record_watermark)
+    elif method == 'insert':
+        insert_rows(db, table, schema_keys, rows)
+        conn = db.raw_connection()
+        try:
+            record_watermark(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+    else:
+        raise ValueError("Unknown load method: %s" % method)
+    if loaded is not None:
+        loaded.update(table=table, watermark=(reader.position,
+                                              loaded_rows + reader.n_rows))
+    return reader.n_rows
+
+def reflect_table(db, schema_name, table_name):
+    """ Inspect a table that was created by `load_table`. """
+    return Table(table_name, MetaData(),
+                 Column('id', types.Integer,
+                        Sequence(table_name + '_id_seq', schema=schema_name),
+                        primary_key=True),
+                 autoload=True, autoload_with=db, schema=schema_name)
+
+def add_columns(db, table, schema):
+    """ Add the columns in `schema` that `table` doesn't have yet, and widen
+    its INTEGER columns that `schema` has as FLOAT. Returns whether the table
+    was altered.
+    """
+    preparer = db.dialect.identifier_preparer
+    existing = {c.name: sql_type_name(c.type) for c in table.columns}
+    statements = []
+    for name, column in sorted(schema.iteritems()):
+        column_type = sql_type_name(column.type)
+        args = (preparer.format_table(table), preparer.quote(name),
+                column.type.compile(dialect=db.dialect))
+        if name not in existing:
+            statements.append('ALTER TABLE %s ADD COLUMN %s %s' % args)
+        elif existing[name] == 'INTEGER' and column_type == 'FLOAT':
+            statements.append('ALTER TABLE %s ALTER COLUMN %s TYPE %s' % args)
+        elif existing[name] != column_type and not (
+                existing[name] == 'FLOAT' and column_type == 'INTEGER'):
+            raise ValueError("Inconsistent schema: %s has type %s in the "
+                             "database, but values of type %s were logged!"
+                             % (name, existing[name], column_type))
+    for statement in statements:
+        print statement
+        db.execute(statement)
+    return bool(statements)
+
+def sql_type_name(sql_type):
+    """ The name in `SQL_TYPES` of a (possibly reflected) column type. """
+    for name, base in SQL_TYPES.iteritems():
+        if isinstance(sql_type, base):
+            return name
+    return str(sql_type)
+
+def set_watermark(db, cursor, schema_name, table_name, dump_id, position,
+                  n_rows):
+    """ Record with a DB-API `cursor` that `table_name` has been loaded up to
+    `position` in the dump identified by `dump_id`, totalling `n_rows` rows
+    from it.
+    """
+    preparer = db.dialect.identifier_preparer
+    watermarks = preparer.format_table(watermark_table(schema_name))
+    cursor.execute('DELETE FROM %s WHERE table_name = %%s AND dump_id = %%s'
+                   % watermarks, (table_name, dump_id))
+    cursor.execute('INSERT INTO %s (table_name, dump_id, dump_position, '
+                   'n_rows) VALUES (%%s, %%s, %%s, %%s)' % watermarks,
+                   (table_name, dump_id, position, n_rows))
+
+def dump_identity(filename):
+    """ Identify the dump at `filename` by its dump id (see
+    `stat_logger.new_dump_id()`), or, if it has none, by the host and path
+    it's read from.
+    """
+    return read_dump_id(filename) or '%s:%s' % (socket.gethostname(),
+                                                os.path.abspath(filename))
+
+def dump_size(filename):
+    """ The position of the end of a dump: its size in bytes for JSON dumps,
+    or its number of rows for columnar ones.
+    """
+    if os.path.isdir(filename):
+        return columnar.read_index(filename)[0]
+    return os.path.getsize(filename)
+
+def iter_dump(filename, columns, start=0, end=None):
+    """ Yield each row dumped to `filename` (a JSON file or a columnar table
+    directory) as a tuple of its values for `columns`.
+    """
+    return DumpReader(filename, start, end).tuples(columns)
+
+class DumpReader(object):
+    """ Reads the rows dumped to a JSON file or a columnar table directory.
+
+    Positions in a dump are byte offsets into JSON files and row numbers into
+    columnar tables. Reading starts at `start` and stops at the last complete
+    row, or at the last one that ends by `end`. Afterwards, `n_rows` is the
+    number of rows read and `position` is just past the last one, where a
+    later read can pick up any rows dumped since.
+
+    In JSON dumps, `position` is kept before the separator that follows each
+    row, so it stays valid when the file is finalized and reopened.
+    """
+    def __init__(self, filename, start=0, end=None):
+        self.filename = filename
+        self.position = start
+        self.end = end
+        self.n_rows = 0
+
+    def tuples(self, columns):
+        """ Yield each row as a tuple of its values for `columns`. """
+        if not os.path.isdir(self.filename):
+            flatten = compile_flattener(columns)
+            for row in self.rows():
+                yield flatten(row)
+            return
+
+        for row in columnar.iter_tuples(self.filename, columns,
+                                        start=self.position, stop=self.end):
+            self.position += 1
+            self.n_rows += 1
+            yield row
+
+    def rows(self):
+        """ Yield each row of a JSON dump as a dict. """
+        with open(self.filename, 'rb') as f:
+            f.seek(self.position)
+            line_start = self.position
+            for raw_line in f:
+                text = raw_line.strip('[],\n')
+                if text:
+                    row_end = line_start + len(raw_line.rstrip('],\n'))
+                    if self.end is not None and row_end > self.end:
+                        break
                     try:
-                        row = parse_line(raw_line)
-                    except Exception as e:
-                        print e
-                        import pdb;pdb.set_trace()
-                        continue # Error with data, just drop it.
+                        row = json.loads(text)
+                    except ValueError:
+                        if raw_line.endswith('\n'):
+                            raise
+                        break # a partially written last row
+                    self.position = row_end
+                    self.n_rows += 1
+                    yield row
+                line_start += len(raw_line)
+
+def insert_rows(db, table, columns, rows, batch_size=10000):
+    """ Insert `rows` (tuples of values for `columns`) into `table` in batches
+    of `batch_size`.
+    """
+    cur_batch = []
+    for i, row in enumerate(rows):
+        cur_batch.append(dict(zip(columns, row)))
+        if (i + 1) % batch_size == 0:
+            print ".",
+            sys.stdout.flush()
+            db.execute(table.insert(), *cur_batch)
+            cur_batch = []
+    if cur_batch:
+        db.execute(table.insert(), *cur_batch)
+
+def copy_rows(db, table, columns, rows, before_commit=None):
+    """ Stream `rows` (tuples of values for `columns`) into `table` with a
+    single `COPY ... FROM STDIN` on one raw connection.
+
+    `before_commit`, if given, is called with the connection's cursor after
+    the rows are copied, to make more changes in the same transaction.
 
-                    # extract all columns and their types
-                    safe_update(schema, extract_schema(row))
+    Falls back to `insert_rows` if the DB driver doesn't support COPY.
+    """
+    conn = db.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            print "DB driver doesn't support COPY, inserting instead...",
+            insert_rows(db, table, columns, rows)
+            if before_commit is not None:
+                before_commit(cursor)
+                conn.commit()
+            return
 
-            print "Done!"
+        preparer = db.dialect.identifier_preparer
+        sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+            preparer.format_table(table),
+            ', '.join(preparer.quote(c) for c in columns))
+        cursor.copy_expert(sql, LineStream(csv_line(row) for row in rows))
+        if before_commit is not None:
+            before_commit(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+def csv_line(values):
+    """ Encode a row of values as a line of CSV for COPY.
+
+    NULLs are unquoted empty fields and strings are always quoted, so empty
+    strings and NULLs stay distinct.
+    """
+    return ','.join([
+        CSV_FORMATTERS.get(type(v), _csv_json)(v) for v in values]) + '\n'
+
+def _csv_float(v):
+    if v != v:
+        return 'NaN'
+    if v in (float('inf'), float('-inf')):
+        return 'Infinity' if v > 0 else '-Infinity'
+    return repr(v)
+
+def _csv_str(v):
+    return '"' + v.replace('"', '""') + '"'
+
+def _csv_json(v):
+    return _csv_str(json.dumps(v))
+
+CSV_FORMATTERS = {
+    type(None): lambda v: '',
+    bool: lambda v: 't' if v else 'f',
+    int: str,
+    long: str,
+    float: _csv_float,
+    str: _csv_str,
+    unicode: lambda v: _csv_str(v.encode('utf-8')),
+}
+
+class LineStream(object):
+    """ A read-only file over an iterator of lines, for `copy_expert`. """
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buf = ''
+
+    def read(self, size=-1):
+        chunks = [self.buf]
+        n_bytes = len(self.buf)
+        if size < 0 or n_bytes < size:
+            for line in self.lines:
+                chunks.append(line)
+                n_bytes += len(line)
+                if size >= 0 and n_bytes >= size:
+                    break
+        data = ''.join(chunks)
+        if size < 0:
+            self.buf = ''
+            return data
+        self.buf = data[size:]
+        return data[:size]
+
+def scan_schema(filename, start=0, end=None):
+    """ Infer the columns of the table dumped to `filename` from its rows
+    between the `DumpReader` positions `start` and `end`.
+    """
+    schema = {}
+    for (i, row) in enumerate(DumpReader(filename, start, end).rows()):
+        if i % 10000 == 0:
+            print ".",
             sys.stdout.flush()
 
-            # create the table
-            metadata = MetaData()
-            table = Table(table_name, metadata,
-                          Column('id', types.Integer,
-                                 Sequence(table_name + '_id_seq',
-                                          schema=schema_name),
-                                 primary_key=True),
-                          *sorted(schema.values(), key=lambda c: c.name),
-                          schema=schema_name)
-            table.create(db)
-            schema_keys = schema.keys()
+        # extract all columns and their types
+        safe_update(schema, extract_schema(row))
+    return schema
+
+SQL_TYPES = {
+    'BOOLEAN': types.Boolean,
+    'INTEGER': types.Integer,
+    'FLOAT': types.Float,
+    'VARCHAR': types.String,
+}
+
+COLUMNAR_TYPES = {
+    'bool': 'BOOLEAN',
+    'int64': 'INTEGER',
+    'float64': 'FLOAT',
+    'str': 'VARCHAR',
+}
+
+def schema_from_sidecar(filename):
+    """ Build the columns of the table dumped to `filename` from the schema
+    stat_logger recorded for it, or return None if there is no up-to-date
+    schema to use. Columnar tables always record their schema.
+    """
+    if os.path.isdir(filename):
+        columns = {name: COLUMNAR_TYPES[column_type] for name, column_type
+                   in columnar.schema(filename).iteritems()}
+    else:
+        columns = read_schema(filename)
+    if columns is None:
+        return None
+    return schema_from_columns(columns)
+
+def schema_from_columns(columns):
+    """ Build table columns from a dict of column type names. """
+    schema = {}
+    for name, column_type in columns.iteritems():
+        if column_type not in SQL_TYPES:
+            raise TypeError("Unrecognized type for DB: " + column_type)
+        schema[name] = Column(name, SQL_TYPES[column_type])
+    return schema
+
+def compile_flattener(columns):
+    """ Compile a function that flattens a parsed row into a tuple of its
+    values for `columns`, in order.
+
+    Columns name nested values as 'outer.inner', as in `extract_data`, and
+    missing values are None. The key paths are resolved once, here, rather
+    than for every row.
+    """
+    lines = ['def flatten(row):', '    get = row.get']
+    nested = {(): 'row'} # key path -> local holding the dict at that path
+    values = []
+    for column in columns:
+        path = tuple(column.split('.'))
+        for depth in range(1, len(path)):
+            if path[:depth] not in nested:
+                var = nested[path[:depth]] = '_d%d' % len(nested)
+                lines.append('    %s = %s.get(%r)' % (
+                    var, nested[path[:depth - 1]], path[depth - 1]))
+                lines.append('    if type(%s) is not dict: %s = EMPTY'
+                             % (var, var))
+        if len(path) == 1:
+            values.append('get(%r)' % column)
         else:
-            print "Table exists. Inspecting from the database..."
-            sys.stdout.flush()
-            metadata = MetaData()
-            table = Table(table_name, metadata, 
-                          Column('id', types.Integer,
-                                 Sequence(table_name + '_id_seq',
-                                          schema=schema_name),
-                                 primary_key=True),
-                          autoload=True, autoload_with=db, schema=schema_name)
-            schema_keys = [c['name'] for c in inspector.get_columns(table_name, schema=schema_name) 
-                           if c['name'] != 'id']
-
-        # insert the data
-        print "Inserting the data into table %s..." % table_name,
-        sys.stdout.flush()
-        with open(filename, 'rb') as f:
-            cur_batch = []
-            for i, raw_line in enumerate(f):
-                row = extract_data(parse_line(raw_line), schema_keys)
-                cur_batch.append(row)
-                if (i + 1) % 10000 == 0:
-                    print ".",
-                    sys.stdout.flush()
-                    db.execute(table.insert(), *cur_batch)
-                    cur_batch = []
-            db.execute(table.insert(), *cur_batch)
-        print "Done!"
-        sys.stdout.flush()
+            # a top-level key may itself contain dots
+            values.append('get(%r, %s.get(%r))'
+                          % (column, nested[path[:-1]], path[-1]))
+    lines.append('    return (%s)' % ''.join(v + ', ' for v in values))
 
-def parse_line(raw_line):
-    return json.loads(raw_line.strip('[],\n'))
+    namespace = {'EMPTY': {}}
+    exec '\n'.join(lines) in namespace
+    return namespace['flatten']
 
 def extract_data(row, schema_keys, key_prefix=''):
     def p(key): return key_prefix + key
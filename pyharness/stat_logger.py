@@ -26,14 +26,43 @@
     >>>     pprint.pprint(table_name + ':')
     >>>     pprint.pprint(table_data)
 
+    # or stream rows without loading whole tables (works mid-experiment, too)
+    >>> for row in iter_rows('iter', where={'run_id': 0}, columns=['val']):
+    >>>     print row['val']
+
 """
 import copy
+import glob
 import json
 import logging
 import os
+import time
+import uuid
+
+import columnar
+import fileutil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 LOGGING_CONFIG = {
     'log_dir': None,
+    'append': False, # add to existing table files instead of truncating them
+
+    # 'json' logs a JSON row per line to <table>.json. 'columnar' logs
+    # typed, memory-mappable column files to <table>.cols/ (see `columnar`).
+    'format': 'json',
+
+    # 'buffered' writes rows straight to the file from an in-memory buffer,
+    # 'logging' sends each row through the logging module.
+    'writer': 'buffered',
+
+    # the buffered writer flushes once any of these limits is reached
+    'flush_rows': 10000,
+    'flush_bytes': 1 << 20,
+    'flush_interval': 5.0, # seconds
 }
 
 LOGGING_DEFAULTS = {
@@ -41,8 +70,19 @@ LOGGING_DEFAULTS = {
 
 LOGGERS = {}
 
+SCHEMA_SUFFIX = '.schema.json'
+
+# the schema at each offset taken, so reopening a table (when appending)
+# doesn't have to parse it all again
+SCHEMA_LOG_SUFFIX = '.schema.log'
+
+# a table's dump id, new each time its logger starts the table over
+DUMP_ID_SUFFIX = '.dump_id'
+
 REQUIRED_LOGGERS = set()
 
+ROW_HOOKS = {}
+
 def configure(settings={}, defaults={}):
     LOGGING_CONFIG.update(**settings)
     LOGGING_DEFAULTS.update(**defaults)
@@ -53,33 +93,288 @@ def getLogger(table_name):
 
     # initialize the logger
     elif table_name not in LOGGERS:
-        logger = logging.getLogger(table_name)
-        logger.setLevel(logging.INFO)
-        logger.propagate = False
         log_dir = LOGGING_CONFIG.get('log_dir')
         if not log_dir:
             raise ValueError("Cannot use StatLogger without a log_dir! "
                              "Did you forget to call `configure()`?")
-        log_file = os.path.join(log_dir, table_name + '.json')
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
-        logger.handlers = []
-        logger.addHandler(logging.FileHandler(log_file))
-        with open(log_file, 'w') as f:
-            f.write('[')
-        LOGGERS[table_name] = StatLogger(logger)
+
+        log_format = LOGGING_CONFIG.get('format')
+        if log_format == 'columnar':
+            path = os.path.join(log_dir, table_name + columnar.SUFFIX)
+            started = (not LOGGING_CONFIG.get('append')
+                       or not os.path.exists(path))
+            LOGGERS[table_name] = ColumnarStatLogger(
+                path,
+                append=LOGGING_CONFIG.get('append'),
+                flush_rows=LOGGING_CONFIG.get('flush_rows'),
+                flush_interval=LOGGING_CONFIG.get('flush_interval'))
+            if started:
+                new_dump_id(path)
+            return LOGGERS[table_name]
+        elif log_format != 'json':
+            raise ValueError("Unknown StatLogger format: %s" % log_format)
+
+        log_file = os.path.join(log_dir, table_name + '.json')
+        if (not LOGGING_CONFIG.get('append')
+            or not os.path.exists(log_file)
+            or os.path.getsize(log_file) == 0):
+            with open(log_file, 'w') as f:
+                f.write('[')
+            if os.path.exists(schema_log_filename(log_file)):
+                os.remove(schema_log_filename(log_file))
+            new_dump_id(log_file)
+
+        writer = LOGGING_CONFIG.get('writer')
+        if writer == 'buffered':
+            LOGGERS[table_name] = StatLogger(BufferedWriter(
+                log_file,
+                flush_rows=LOGGING_CONFIG.get('flush_rows'),
+                flush_bytes=LOGGING_CONFIG.get('flush_bytes'),
+                flush_interval=LOGGING_CONFIG.get('flush_interval')))
+        elif writer == 'logging':
+            LOGGERS[table_name] = StatLogger(
+                LoggingWriter(table_name, log_file))
+        else:
+            raise ValueError("Unknown StatLogger writer: %s" % writer)
 
     return LOGGERS[table_name]
 
+def table_files(log_dir):
+    """ List `(table_name, filename)` for each table logged under `log_dir`.
+    """
+    tables = []
+    for filename in sorted(glob.glob(os.path.join(log_dir, '*.json'))):
+        if not filename.endswith(SCHEMA_SUFFIX):
+            table_name = os.path.splitext(os.path.basename(filename))[0]
+            tables.append((table_name, filename))
+    return tables
+
+def schema_filename(filename):
+    """ The schema sidecar for the table logged to `filename`. """
+    return os.path.splitext(filename)[0] + SCHEMA_SUFFIX
+
+def schema_log_filename(filename):
+    """ The log of the schemas of the table logged to `filename` at each
+    offset taken (see `StatLogger.offset()`).
+    """
+    return os.path.splitext(filename)[0] + SCHEMA_LOG_SUFFIX
+
+def read_schema_log(filename, size=None):
+    """ Read the schema logged for the table logged to `filename` at the
+    latest offset up to `size` (by default, the file's size).
+
+    Returns `(offset, columns, valid)`, or `(0, {}, True)` if no schema was
+    logged that early.
+    """
+    if size is None:
+        size = os.path.getsize(filename)
+    entry = (0, {}, True)
+    try:
+        with open(schema_log_filename(filename), 'rb') as f:
+            lines = f.readlines()
+    except IOError:
+        return entry
+    columns, valid = {}, True
+    for line in lines:
+        try:
+            logged = json.loads(line)
+        except ValueError:
+            break # cut off mid-write
+        if logged['size'] > size:
+            break
+        if 'columns' in logged:
+            columns, valid = logged['columns'], logged['valid']
+        entry = (logged['size'], columns, valid)
+    return entry
+
+def _rollback_schema_log(filename, offset):
+    # drop the schemas logged past `offset`
+    log_filename = schema_log_filename(filename)
+    try:
+        with open(log_filename, 'rb') as f:
+            lines = f.readlines()
+    except IOError:
+        return
+    kept = []
+    for line in lines:
+        try:
+            if json.loads(line)['size'] > offset:
+                break
+        except ValueError:
+            break # cut off mid-write
+        kept.append(line)
+    with fileutil.atomic_write(log_filename) as f:
+        f.writelines(kept)
+
+def dump_id_filename(filename):
+    """ The dump id file of the table logged to `filename`. """
+    return os.path.splitext(filename)[0] + DUMP_ID_SUFFIX
+
+def new_dump_id(filename):
+    """ Give the table logged to `filename` a new dump id, as its logger
+    starts it over, so loaders can tell it from earlier dumps of the table.
+    """
+    with fileutil.atomic_write(dump_id_filename(filename)) as f:
+        f.write(uuid.uuid4().hex)
+
+def read_dump_id(filename):
+    """ The dump id of the table logged to `filename`, or None if it has
+    none (it was logged before dump ids were).
+    """
+    try:
+        with open(dump_id_filename(filename), 'rb') as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+def read_schema(filename):
+    """ Read the column types recorded for the table logged to `filename`.
+
+    Returns None if there is no sidecar, or if it doesn't describe the
+    table's current contents.
+    """
+    try:
+        with open(schema_filename(filename), 'rb') as f:
+            sidecar = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if (not sidecar.get('valid')
+        or sidecar.get('size') != os.path.getsize(filename)):
+        return None
+    return sidecar['columns']
+
 def requireLoggers(*table_names):
     REQUIRED_LOGGERS.update(set(table_names))
 
+def addRowHook(table_name, hook):
+    """ Call `hook` with each row logged to `table_name` (including the
+    defaults), as it is ended. Hooks must not modify rows.
+    """
+    ROW_HOOKS.setdefault(table_name, []).append(hook)
+
+def removeRowHook(table_name, hook):
+    ROW_HOOKS[table_name].remove(hook)
+
 def finalize(table_names=None):
     if table_names is None:
         table_names = LOGGERS.iterkeys()
     for table_name in table_names:
         getLogger(table_name).finalize()
 
+def flush(table_names=None):
+    """ Write any buffered rows to disk. """
+    if table_names is None:
+        table_names = LOGGERS.iterkeys()
+    for table_name in table_names:
+        getLogger(table_name).flush()
+
+def offsets():
+    """ Map each open table to the byte offset its file is written up to. """
+    table_offsets = {}
+    for table_name, logger in LOGGERS.iteritems():
+        offset = logger.offset()
+        if offset is not None:
+            table_offsets[table_name] = offset
+    return table_offsets
+
+def column_types():
+    """ Map each open JSON table to the column types of the rows logged to
+    it so far (see `SchemaTracker`), unless they are inconsistent.
+    """
+    table_columns = {}
+    for table_name, logger in LOGGERS.iteritems():
+        columns = logger.column_types()
+        if columns is not None:
+            table_columns[table_name] = columns
+    return table_columns
+
+def io_stats():
+    """ Map each open table to `(rows, bytes, flush_seconds)`: the rows logged
+    to it so far, the bytes they take in its file (for columnar tables, once
+    they are flushed), and the time spent flushing it.
+    """
+    stats = {}
+    for table_name, logger in LOGGERS.iteritems():
+        table_stats = logger.io_stats()
+        if table_stats is not None:
+            stats[table_name] = table_stats
+    return stats
+
+def rollback(log_dir, offsets):
+    """ Truncate every table under `log_dir` to its offset in `offsets`.
+
+    Rows (or partial rows) written after the offsets are dropped, and the
+    tables are left unfinalized so more rows can be appended. Tables missing
+    from `offsets` are emptied.
+
+    Raises a ValueError, before truncating anything, if an offset is past
+    the end of its table's file (its rows were lost).
+    """
+    json_offsets = []
+    for table_name, filename in table_files(log_dir):
+        offset = max(offsets.get(table_name, 1), 1)
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size > 1:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) == ']':
+                    size += 1 # where finalize() removed the last ',\n'
+        if offset > size:
+            raise ValueError("Can't roll %s back to byte %d; it only has "
+                             "%d bytes" % (filename, offset, size))
+        json_offsets.append((filename, offset))
+
+    for table_name, path in columnar.table_dirs(log_dir):
+        columnar.rollback(path, offsets.get(table_name, 0))
+
+    for filename, offset in json_offsets:
+        with open(filename, 'rb+') as f:
+            f.truncate(offset)
+            if offset > 1:
+                # a finalized file has ']' where the last row's ',\n' was
+                f.seek(offset - 2)
+                f.write(',\n')
+            else:
+                f.seek(0)
+                f.write('[')
+        _rollback_schema_log(filename, offset)
+
+def reset():
+    """ Forget every open logger without finalizing it.
+
+    Used by worker processes, which inherit the parent's loggers on fork but
+    must log to their own files. The parent should `flush()` before forking.
+    """
+    for logger in LOGGERS.itervalues():
+        logger.close()
+    LOGGERS.clear()
+
+def absorb(log_dir):
+    """ Append every table logged under `log_dir` (e.g., by a worker process)
+    to this process's loggers.
+
+    Rows are copied verbatim, so they keep the defaults they were logged with.
+    Tables that were logged are required here too, even if only the other
+    process required them.
+    """
+    for table_name, filename in table_files(log_dir):
+        requireLoggers(table_name)
+        logger = getLogger(table_name)
+        columns = read_schema(filename)
+        for row in _iter_raw_rows(filename):
+            logger.write_row(row)
+            if columns is None:
+                logger.schema.add_row(json.loads(row))
+        if columns is not None:
+            logger.schema.add_columns(columns)
+
+    for table_name, path in columnar.table_dirs(log_dir):
+        requireLoggers(table_name)
+        getLogger(table_name).append_table(path)
+
 def load(table_names=None):
     if table_names is None:
         table_names = LOGGERS.iterkeys()
@@ -88,54 +383,504 @@ def load(table_names=None):
         tables[table_name] = getLogger(table_name).load()
     return tables
 
+def iter_rows(table_name, chunk_size=None, columns=None, where=None,
+              log_dir=None):
+    """ Lazily iterate over the rows logged to `table_name`.
+
+    Unlike `load()`, this streams the file, and works on tables that are
+    still being written (a partially written last row is skipped).
+
+    `chunk_size` yields lists of up to `chunk_size` rows instead of rows.
+
+    `columns` keeps only the listed keys of each row.
+
+    `where` maps keys to the values rows must have, e.g. grid parameters. A
+    value may also be a list of allowed values or a predicate function.
+    Nested values can be named 'outer.inner'.
+
+    `log_dir` defaults to the configured log directory.
+    """
+    if table_name in LOGGERS:
+        LOGGERS[table_name].flush()
+    log_dir = log_dir or LOGGING_CONFIG.get('log_dir')
+    path = os.path.join(log_dir, table_name + columnar.SUFFIX)
+    if os.path.isdir(path):
+        rows = _iter_columnar_rows(path, columns, where)
+    else:
+        rows = _iter_rows(os.path.join(log_dir, table_name + '.json'),
+                          columns, where)
+    if not chunk_size:
+        return rows
+    return _chunks(rows, chunk_size)
+
+def parse_line(raw_line):
+    return json.loads(raw_line.strip('[],\n'))
+
+def _conditions(where):
+    conditions = []
+    for key, value in (where or {}).iteritems():
+        if callable(value):
+            matches = value
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            matches = lambda v, allowed=value: v in allowed
+        else:
+            matches = lambda v, wanted=value: v == wanted
+        conditions.append((key, matches))
+    return conditions
+
+def _iter_rows(filename, columns, where):
+    conditions = [(key.split('.'), matches)
+                  for key, matches in _conditions(where)]
+
+    # a row can only match if it contains the encoded key/value pairs
+    needles = [ROW_ENCODER.encode({key: value})[1:-1]
+               for key, value in (where or {}).iteritems()
+               if '.' not in key and (value is None or
+                                      isinstance(value, (basestring, bool,
+                                                         int, long)))]
+
+    with open(filename, 'rb') as f:
+        for raw_line in f:
+            if any(needle not in raw_line for needle in needles):
+                continue
+            text = raw_line.strip('[],\n')
+            if not text:
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                if raw_line.endswith('\n'):
+                    raise
+                break # a partially written last row
+            if all(matches(_lookup(row, path))
+                   for path, matches in conditions):
+                if columns is not None:
+                    row = {k: row[k] for k in columns if k in row}
+                yield row
+
+def _iter_columnar_rows(path, columns, where):
+    conditions = _conditions(where)
+    names = sorted(columnar.schema(path))
+    for values in columnar.iter_tuples(path, names):
+        row = {name: v for name, v in zip(names, values) if v is not None}
+        if all(matches(row.get(key)) for key, matches in conditions):
+            if columns is not None:
+                row = {k: row[k] for k in columns if k in row}
+            yield row
+
+def _lookup(row, path):
+    for key in path:
+        if not isinstance(row, dict):
+            return None
+        row = row.get(key)
+    return row
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _iter_raw_rows(filename, start=0):
+    # yield the JSON text of each row from byte `start` (the start of a
+    # row), finalized or not
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        for raw_line in f:
+            row = raw_line.strip('[],\n')
+            if row:
+                yield row
+
+class RowEncoder(json.JSONEncoder):
+    """ Encodes a row in one pass.
+
+    Rows of primitives never leave json's C encoder. Any other value is
+    converted by a function looked up once per type: NumPy scalars and arrays
+    become numbers and lists, and anything else is logged by name.
+    """
+    converters = {}
+
+    def default(self, value):
+        try:
+            convert = self.converters[type(value)]
+        except KeyError:
+            convert = self.converters[type(value)] = _converter(type(value))
+        return convert(value)
+
+def _converter(cls):
+    if np is not None:
+        if issubclass(cls, np.ndarray):
+            return lambda value: value.tolist()
+        if issubclass(cls, np.generic):
+            return lambda value: value.item()
+    return _name
+
+def _name(value):
+    # It must be some unknown class. Just use the class name.
+    try:
+        return value.__name__
+    except AttributeError:
+        return type(value).__name__
+
+ROW_ENCODER = RowEncoder()
+
+COLUMN_TYPES = {
+    bool: 'BOOLEAN',
+    int: 'INTEGER',
+    long: 'INTEGER',
+    float: 'FLOAT',
+    str: 'VARCHAR',
+    unicode: 'VARCHAR',
+}
+
+NUMERIC_TYPES = ('INTEGER', 'FLOAT')
+
+class SchemaTracker(object):
+    """ Tracks the flattened column names and types of logged rows, the same
+    way stat_loader infers them from a dump: nested dicts become
+    'outer.inner' columns, INTEGER and FLOAT columns widen to FLOAT, and
+    columns that are only ever None are left out.
+
+    If a column is logged with incompatible types, the schema is marked
+    invalid and the loader falls back to inferring it (and reporting the
+    error) itself.
+    """
+    def __init__(self):
+        self.columns = {}
+        self.valid = True
+        self.seen = {} # column name -> type of its last value
+
+    def add_row(self, row, key_prefix=''):
+        for k, v in row.iteritems():
+            if type(k) is not str:
+                k = _json_key(k)
+            name = key_prefix + k
+            cls = type(v)
+            if self.seen.get(name) is cls:
+                continue
+            if isinstance(v, dict):
+                self.add_row(v, key_prefix=name + '.')
+            elif v is not None:
+                self.seen[name] = cls
+                self.add_column(name, _column_type(v))
+
+    def add_columns(self, columns):
+        for name, column_type in columns.iteritems():
+            self.add_column(name, column_type)
+
+    def add_column(self, name, column_type):
+        old_type = self.columns.get(name)
+        if old_type is None or old_type == column_type:
+            self.columns[name] = column_type
+        elif old_type in NUMERIC_TYPES and column_type in NUMERIC_TYPES:
+            self.columns[name] = 'FLOAT'
+        else:
+            self.valid = False
+
+def _column_type(value):
+    # mirror how json encodes the value
+    column_type = COLUMN_TYPES.get(type(value))
+    if column_type is not None:
+        return column_type
+    if isinstance(value, basestring):
+        return 'VARCHAR'
+    if isinstance(value, (int, long)):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'FLOAT'
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ # not loadable
+    return _column_type(ROW_ENCODER.default(value))
+
+def _json_key(key):
+    # json writes non-string keys as strings
+    if isinstance(key, unicode):
+        return key
+    return json.dumps(key).strip('"')
+
 class StatLogger(object):
-    def __init__(self, logger):
-        self.logger = logger
-        self.filename = logger.handlers[0].baseFilename
+    def __init__(self, writer):
+        self.writer = writer
+        self.filename = writer.filename
+        self.table_name = os.path.splitext(os.path.basename(self.filename))[0]
         self.cur_row = {}
+        self.n_rows = 0
+        self.n_bytes = 0
+
+        # rows already in the file (when appending) are part of the schema;
+        # only those after the last logged schema need to be parsed
+        self.schema = SchemaTracker()
+        self.logged_size, columns, self.schema.valid = read_schema_log(
+            self.filename)
+        self.schema.add_columns(columns)
+        self.logged_schema = (dict(self.schema.columns), self.schema.valid)
+        for row in _iter_raw_rows(self.filename, self.logged_size):
+            self.schema.add_row(json.loads(row))
 
     def log(self, **stats):
         self.cur_row.update(stats)
 
     def end_row(self):
         self.cur_row.update(LOGGING_DEFAULTS)
-        message = json.dumps(self.to_json(self.cur_row)) + ','
-        self.logger.info(message) # Persist the data
+        self.write_row(ROW_ENCODER.encode(self.cur_row))
+        self.schema.add_row(self.cur_row)
+        for hook in ROW_HOOKS.get(self.table_name, ()):
+            hook(self.cur_row)
         self.cur_row = {}
 
+    def write_row(self, row):
+        self.writer.write(row + ',') # Persist the data
+        self.n_rows += 1
+        self.n_bytes += len(row) + 2
+
+    def flush(self):
+        self.writer.flush()
+
     def finalize(self):
+        self.writer.flush()
         with open(self.filename, 'rb+') as f:
-            # remove the last comma in the file
-            f.seek(-2, os.SEEK_END) # -2 for the last comma and a newline
-            f.truncate()
+            # remove the last comma in the file, unless no rows were logged
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 1:
+                f.seek(-2, os.SEEK_END) # -2 for the last comma and a newline
+                f.truncate()
 
             # close the json list
             f.write(']')
+            size = f.tell()
+
+        # record the schema so the loader doesn't have to infer it
+        with open(schema_filename(self.filename), 'wb') as f:
+            json.dump({'columns': self.schema.columns,
+                       'valid': self.schema.valid,
+                       'size': size}, f)
 
     def load(self):
         with open(self.filename, 'rb') as f:
             return json.load(f)
 
-    def valid_json(self, value):
-        # try coercing to json
-        try:
-            json.dumps(value)
-            return value
-        except TypeError:
-            pass
+    def iter_rows(self, chunk_size=None, columns=None, where=None):
+        """ Lazily iterate over this table's rows. See `iter_rows()`. """
+        self.flush()
+        rows = _iter_rows(self.filename, columns, where)
+        if not chunk_size:
+            return rows
+        return _chunks(rows, chunk_size)
 
-        # is it a dictionary? recurse
-        if isinstance(value, dict):
-            return { k: self.valid_json(v) for k, v in value.iteritems() }
+    def offset(self):
+        self.writer.flush()
+        size = os.path.getsize(self.filename)
+        self.log_schema(size)
+        return size
 
-        # Otherwise it must be some unknown class. Just use the class name.
-        return value.__name__
+    def log_schema(self, size):
+        """ Log the schema of the rows written up to `size`, the file's
+        current size. Unchanged schemas are logged by size alone.
+        """
+        if size == self.logged_size:
+            return
+        entry = {'size': size}
+        schema = (self.schema.columns, self.schema.valid)
+        if schema != self.logged_schema:
+            entry.update(columns=schema[0], valid=schema[1])
+            self.logged_schema = (dict(schema[0]), schema[1])
+        with open(schema_log_filename(self.filename), 'ab') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.logged_size = size
+
+    def column_types(self):
+        return dict(self.schema.columns) if self.schema.valid else None
+
+    def io_stats(self):
+        return self.n_rows, self.n_bytes, self.writer.flush_time
+
+    def close(self):
+        self.writer.close()
+
+class ColumnarStatLogger(object):
+    """ A StatLogger that logs to a columnar table (see `columnar`).
+
+    Rows are flattened into 'outer.inner' columns and buffered, then written
+    as a chunk once `flush_rows` rows or `flush_interval` seconds have
+    accumulated, or on `flush()`. `load()` returns a dict of (memory-mapped)
+    column arrays, and `iter_rows()` returns flattened rows.
+    """
+    def __init__(self, path, append=False, flush_rows=None,
+                 flush_interval=None):
+        self.writer = columnar.ColumnarWriter(path, append=append)
+        self.filename = path
+        self.table_name = os.path.basename(path)[:-len(columnar.SUFFIX)]
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.cur_row = {}
+        self.rows = []
+        self.last_flush = time.time()
+        self.n_rows = 0
+        self.flush_time = 0.0
+
+    def log(self, **stats):
+        self.cur_row.update(stats)
+
+    def end_row(self):
+        self.cur_row.update(LOGGING_DEFAULTS)
+        for hook in ROW_HOOKS.get(self.table_name, ()):
+            hook(self.cur_row)
+        row = {}
+        _flatten(self.cur_row, row)
+        self.rows.append(row)
+        self.n_rows += 1
+        self.cur_row = {}
+        if ((self.flush_rows and len(self.rows) >= self.flush_rows)
+            or (self.flush_interval is not None
+                and time.time() - self.last_flush >= self.flush_interval)):
+            self.flush()
+
+    def write_row(self, row):
+        flat_row = {}
+        _flatten(json.loads(row), flat_row)
+        self.rows.append(flat_row)
+        self.n_rows += 1
+
+    def append_table(self, path):
+        """ Append every row of the columnar table at `path`. """
+        self.flush()
+        start = time.time()
+        n_rows = columnar.read_index(path)[0]
+        column_types = columnar.schema(path)
+        chunk = {}
+        for name, array in columnar.load(path).iteritems():
+            chunk[name] = (column_types[name], array.data,
+                           np.ma.getmaskarray(array))
+        self.writer.append(chunk, n_rows)
+        self.n_rows += n_rows
+        self.flush_time += time.time() - start
+
+    def flush(self):
+        start = time.time()
+        if self.rows:
+            names = set()
+            for row in self.rows:
+                names.update(row)
+            chunk = {}
+            for name in names:
+                values = [row.get(name) for row in self.rows]
+                chunk[name] = (columnar.chunk_type(values), values,
+                               [v is None for v in values])
+            self.writer.append(chunk, len(self.rows))
+            self.rows = []
+        self.last_flush = time.time()
+        self.flush_time += self.last_flush - start
+
+    def finalize(self):
+        self.flush()
+
+    def load(self):
+        self.flush()
+        return columnar.load(self.filename)
+
+    def iter_rows(self, chunk_size=None, columns=None, where=None):
+        """ Lazily iterate over this table's rows. See `iter_rows()`. """
+        self.flush()
+        rows = _iter_columnar_rows(self.filename, columns, where)
+        if not chunk_size:
+            return rows
+        return _chunks(rows, chunk_size)
+
+    def offset(self):
+        self.flush()
+        return self.writer.n_rows
+
+    def column_types(self):
+        return None # the table records its own schema
+
+    def io_stats(self):
+        return self.n_rows, self.writer.n_bytes, self.flush_time
+
+    def close(self):
+        self.flush()
+
+def _flatten(row, flat_row, key_prefix=''):
+    # flatten nested dicts and convert values to what json would log
+    for k, v in row.iteritems():
+        if type(k) is not str:
+            k = _json_key(k)
+        if isinstance(v, dict):
+            _flatten(v, flat_row, key_prefix + k + '.')
+            continue
+        while not (v is None or isinstance(v, (basestring, bool, int, long,
+                                               float, list, tuple))):
+            v = ROW_ENCODER.default(v)
+        flat_row[key_prefix + k] = v
+
+class BufferedWriter(object):
+    """ Appends rows to a file through a large in-memory buffer.
+
+    The buffer is written out once it holds `flush_rows` rows or
+    `flush_bytes` bytes, once `flush_interval` seconds have passed since the
+    last write (checked as rows arrive), or when `flush()` is called.
+    """
+    def __init__(self, filename, flush_rows=None, flush_bytes=None,
+                 flush_interval=None):
+        self.filename = filename
+        self.f = open(filename, 'ab', 0) # we do our own buffering
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.buf = []
+        self.buf_bytes = 0
+        self.last_flush = time.time()
+        self.flush_time = 0.0
 
-    def to_json(self, stats_dict):
-        new_dict = {}
-        for k, v in stats_dict.iteritems():
-            new_dict[k] = self.valid_json(v)
-        return new_dict
+    def write(self, message):
+        self.buf.append(message + '\n')
+        self.buf_bytes += len(message) + 1
+        if ((self.flush_rows and len(self.buf) >= self.flush_rows)
+            or (self.flush_bytes and self.buf_bytes >= self.flush_bytes)
+            or (self.flush_interval is not None
+                and time.time() - self.last_flush >= self.flush_interval)):
+            self.flush()
+
+    def flush(self):
+        start = time.time()
+        if self.buf:
+            self.f.write(''.join(self.buf))
+            self.buf = []
+            self.buf_bytes = 0
+        self.last_flush = time.time()
+        self.flush_time += self.last_flush - start
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+class LoggingWriter(object):
+    """ Sends each row through a `logging.Logger` with a FileHandler. """
+    def __init__(self, table_name, filename):
+        self.filename = filename
+        self.logger = logging.getLogger(table_name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [logging.FileHandler(filename)]
+        self.flush_time = 0.0
+
+    def write(self, message):
+        # the handler writes each row through to the file
+        start = time.time()
+        self.logger.info(message)
+        self.flush_time += time.time() - start
+
+    def flush(self):
+        for handler in self.logger.handlers:
+            handler.flush()
+
+    def close(self):
+        for handler in self.logger.handlers:
+            handler.close()
+        self.logger.handlers = []
 
 class DummyStatLogger(object):
     def __init__(self):
@@ -147,8 +892,29 @@ class DummyStatLogger(object):
     def end_row(self):
         pass
 
+    def write_row(self, row):
+        pass
+
+    def flush(self):
+        pass
+
     def finalize(self):
         pass
 
     def load(self):
         return {}
+
+    def iter_rows(self, chunk_size=None, columns=None, where=None):
+        return iter([])
+
+    def offset(self):
+        return None
+
+    def column_types(self):
+        return None
+
+    def io_stats(self):
+        return None
+
+    def close(self):
+        pass
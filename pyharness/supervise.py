@@ -0,0 +1,121 @@
+""" supervise: run grid point runs in subprocesses with resource limits.
+
+    With a wall-clock timeout, a memory limit or a CPU time limit, each run
+    is forked into its own process, which logs to a scratch directory
+    (`<log_dir>/_harness/run/`). If the run finishes, its rows are appended
+    to the real tables. If it times out, is killed, or raises, its rows are
+    dropped, a row describing what happened is logged to the
+    `_harness_status` table, and the sweep moves on.
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import stat_logger
+
+STATUS_TABLE = '_harness_status'
+
+RUN_DIR = os.path.join('_harness', 'run')
+
+def call_run(func, grid_point, tracker=None, limits=None):
+    """ Call `func(**grid_point)` for the current run, and return its sample
+    for `tracker` (an `adaptive.MetricTracker`), if any.
+
+    `limits` maps 'timeout' and 'cpu_limit' to seconds and 'memory_limit' to
+    megabytes. If any is set, the run is supervised (see above), and a run
+    that doesn't finish returns None.
+    """
+    if not limits or not any(limits.itervalues()):
+        func(**grid_point)
+        return tracker.end_run() if tracker else None
+
+    run_dir = os.path.join(stat_logger.LOGGING_CONFIG['log_dir'], RUN_DIR)
+    shutil.rmtree(run_dir, ignore_errors=True)
+    stat_logger.flush() # the child inherits our loggers' buffers
+
+    start = time.time()
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_child,
+                                   args=(func, grid_point, run_dir, tracker,
+                                         limits, writer))
+    proc.start()
+    writer.close()
+    try:
+        result = None
+        if reader.poll(limits.get('timeout')):
+            try:
+                result = reader.recv()
+            except EOFError:
+                pass # died without reporting
+            proc.join()
+        else:
+            result = ('timeout', None, "Timed out after %s seconds."
+                      % limits['timeout'])
+    finally:
+        if proc.is_alive():
+            _kill(proc)
+        reader.close()
+    elapsed = time.time() - start
+
+    if result is None:
+        signum = -proc.exitcode if proc.exitcode < 0 else None
+        result = ('killed', None, "Killed by signal %d." % signum if signum
+                  else "Exited with code %d." % proc.exitcode)
+    status, value, message = result
+    if status == 'ok':
+        stat_logger.absorb(run_dir)
+    else:
+        print "Run %s: %s" % (status, message.strip().splitlines()[-1]),
+        stat_logger.requireLoggers(STATUS_TABLE)
+        status_log = stat_logger.getLogger(STATUS_TABLE)
+        status_log.log(status=status, message=message, elapsed=elapsed,
+                       exitcode=proc.exitcode)
+        status_log.end_row()
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return value
+
+def _child(func, grid_point, run_dir, tracker, limits, writer):
+    # a process group of its own, so the whole run can be killed
+    os.setpgid(0, 0)
+    stat_logger.reset()
+    stat_logger.configure(settings={'log_dir': run_dir, 'append': False})
+    if tracker:
+        tracker.end_run() # drop anything collected before the fork
+    try:
+        _set_limits(limits.get('memory_limit'), limits.get('cpu_limit'))
+        func(**grid_point)
+        value = tracker.end_run() if tracker else None
+        stat_logger.finalize()
+    except Exception:
+        writer.send(('error', None, traceback.format_exc()))
+        return
+    writer.send(('ok', value, None))
+
+def _set_limits(memory_limit, cpu_limit):
+    if not memory_limit and not cpu_limit:
+        return
+    if resource is None:
+        raise RuntimeError("Resource limits aren't supported on this "
+                           "platform.")
+    if memory_limit:
+        n_bytes = int(memory_limit * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (n_bytes, n_bytes))
+    if cpu_limit:
+        # SIGXCPU kills the run at the soft limit
+        seconds = int(cpu_limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.terminate()
+    proc.join()
@@ -0,0 +1,77 @@
+""" timing: a store of how long grid points took to run, for scheduling.
+
+    ParamGrid records the wall time of every run, keyed by its grid point's
+    parameters, in a small JSON file (`<log_dir>/_harness/timings.json` by
+    default, out of the way of the tables in `<log_dir>`).
+    Later sweeps over the same points use the recorded times to start the
+    most expensive points first and to balance partitions.
+"""
+import json
+import os
+
+import fileutil
+
+TIMING_FILE = os.path.join('_harness', 'timings.json')
+
+class TimingStore(object):
+    def __init__(self, filename):
+        """ Open the store in `filename`, reading any recorded timings. """
+        self.filename = filename
+        self.timings = _read(filename) # key -> [total seconds, number of runs]
+        self.pending = {} # timings recorded since the last save
+
+    def record(self, grid_point, elapsed):
+        """ Record that a run of `grid_point` took `elapsed` seconds. """
+        for timings in (self.timings, self.pending):
+            total = timings.setdefault(_key(grid_point), [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+
+    def estimate(self, grid_point):
+        """ The mean recorded runtime of `grid_point`, or None. """
+        total = self.timings.get(_key(grid_point))
+        if not total or not total[1]:
+            return None
+        return total[0] / total[1]
+
+    def estimator(self):
+        """ A cost function from grid points to their estimated runtimes, or
+        None if nothing has been recorded. Points without timings are
+        estimated at the mean of the recorded ones.
+        """
+        means = [total / n for total, n in self.timings.itervalues() if n]
+        if not means:
+            return None
+        default = sum(means) / len(means)
+        def cost(grid_point):
+            estimate = self.estimate(grid_point)
+            return default if estimate is None else estimate
+        return cost
+
+    def save(self):
+        """ Add the timings recorded since the last save to the file.
+
+        The file is re-read first, so nodes sharing a store keep each
+        other's timings.
+        """
+        timings = _read(self.filename)
+        for key, (seconds, n_runs) in self.pending.iteritems():
+            total = timings.setdefault(key, [0.0, 0])
+            total[0] += seconds
+            total[1] += n_runs
+
+        fileutil.makedirs(os.path.dirname(os.path.abspath(self.filename)))
+        with fileutil.atomic_write(self.filename) as f:
+            json.dump(timings, f)
+        self.timings = timings
+        self.pending = {}
+
+def _read(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _key(grid_point):
+    return json.dumps(grid_point, sort_keys=True)
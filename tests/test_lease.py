@@ -0,0 +1,196 @@
+""" Runs several `lease.work()` processes on one queue, stopping or killing
+one of them mid-task, and checks that every task is logged exactly once
+after the coordinator merges the shards.
+
+Run with `python -m unittest discover tests`.
+"""
+import collections
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from pyharness import checkpoint, lease, parallel, stat_logger
+
+LEASE_TIMEOUT = 1.0
+
+N_POINTS = 12
+
+GRID_POINTS = dict((grid_point_id, {'n': grid_point_id})
+                   for grid_point_id in range(N_POINTS))
+
+STALL = {'seconds': 0, 'signal_dir': None} # set in the stalling worker
+
+def log_rows(n):
+    log = stat_logger.getLogger('out')
+    for i in range(2):
+        log.log(i=i, n=n)
+        log.end_row()
+    if STALL['seconds']:
+        seconds, STALL['seconds'] = STALL['seconds'], 0
+        stat_logger.flush()
+        task = (stat_logger.LOGGING_DEFAULTS['grid_point_id'],
+                stat_logger.LOGGING_DEFAULTS['run_id'])
+        with open(os.path.join(STALL['signal_dir'], 'stalled'), 'wb') as f:
+            f.write('%d %d' % task)
+        time.sleep(seconds)
+    time.sleep(0.05)
+
+def log_rows_finished_elsewhere(n):
+    # another worker finishes every task but the first while it runs
+    log_rows(n)
+    if n > 0:
+        OTHER_WORKER['queue'].complete((n, 0), {'worker': 'other',
+                                                'shard': 'other',
+                                                'offsets': {}})
+
+OTHER_WORKER = {'queue': None}
+
+def run_worker(log_dir, stall_seconds=0, signal_dir=None):
+    sys.stdout = open(os.devnull, 'wb')
+    STALL.update(seconds=stall_seconds, signal_dir=signal_dir)
+    stat_logger.reset()
+    stat_logger.requireLoggers('out')
+    lease.work(log_rows, log_dir, GRID_POINTS, lease_timeout=LEASE_TIMEOUT,
+               poll_interval=0.05)
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.tmp_dir, 'logs')
+        self.tasks = [(grid_point_id, 0) for grid_point_id in range(N_POINTS)]
+        self.queue = lease.LeaseQueue(self.log_dir, LEASE_TIMEOUT)
+        self.markers = {}
+        self.coordinator = None
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'wb')
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def tearDown(self):
+        stat_logger.reset()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def start_sweep(self, stall_seconds):
+        """ Start a coordinator thread, two workers and one that stalls in
+        its first task. Returns the workers and the stalled task.
+        """
+        workers = [multiprocessing.Process(target=run_worker,
+                                           args=(self.log_dir,))
+                   for _ in range(2)]
+        workers.append(multiprocessing.Process(
+            target=run_worker,
+            args=(self.log_dir, stall_seconds, self.tmp_dir)))
+        for worker in workers:
+            worker.start()
+        self.coordinator = threading.Thread(target=self.coordinate)
+        self.coordinator.start()
+        return workers, self.wait_stalled()
+
+    def coordinate(self):
+        self.markers = lease.coordinate(self.queue, self.tasks,
+                                        poll_interval=0.05)
+
+    def wait_stalled(self):
+        filename = os.path.join(self.tmp_dir, 'stalled')
+        deadline = time.time() + 30
+        while not os.path.exists(filename):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        with open(filename, 'rb') as f:
+            return tuple(int(i) for i in f.read().split())
+
+    def wait_done(self, task):
+        deadline = time.time() + 30
+        while task not in self.queue.done_tasks():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def merge(self, workers):
+        for worker in workers:
+            worker.join(30)
+        if self.coordinator:
+            self.coordinator.join(30)
+            self.assertFalse(self.coordinator.is_alive())
+        self.assertEqual(sorted(self.markers), self.tasks)
+
+        stat_logger.configure(settings={'log_dir': self.log_dir,
+                                        'append': False})
+        manifest = checkpoint.Manifest(self.log_dir)
+        lease.discard_shards(self.log_dir, self.queue.sweep)
+        lease.repair_shards(self.log_dir, self.markers)
+        parallel.resume_shards(self.log_dir)
+        parallel.merge_shards(self.log_dir, manifest)
+        stat_logger.finalize()
+        manifest.close()
+        return manifest
+
+    def assert_logged_once(self, manifest, tasks=None):
+        tasks = self.tasks if tasks is None else tasks
+        counts = collections.Counter(
+            (row['grid_point_id'], row['run_id'], row['i'])
+            for row in stat_logger.iter_rows('out', log_dir=self.log_dir))
+        expected = collections.Counter(
+            (grid_point_id, run_id, i) for grid_point_id, run_id in tasks
+            for i in range(2))
+        self.assertEqual(counts, expected)
+        self.assertEqual(sorted(manifest.completed), self.tasks)
+
+    def assert_taken_over(self, task, worker):
+        self.assertNotEqual(self.markers[task]['worker'].rsplit('-', 1)[1],
+                            str(worker.pid))
+
+    def test_killed_worker(self):
+        # the killed worker's lease expires, and its task is run again
+        workers, stalled = self.start_sweep(stall_seconds=60)
+        os.kill(workers[-1].pid, signal.SIGKILL)
+        self.wait_done(stalled)
+        self.assert_logged_once(self.merge(workers))
+        self.assert_taken_over(stalled, workers[-1])
+
+    def test_duplicate_completion(self):
+        # a stopped worker's lease expires, and it resumes after its task
+        # was finished by another worker, so its rows are rolled back
+        workers, stalled = self.start_sweep(stall_seconds=3 * LEASE_TIMEOUT)
+        os.kill(workers[-1].pid, signal.SIGSTOP)
+        self.wait_done(stalled)
+        os.kill(workers[-1].pid, signal.SIGCONT)
+        self.assert_logged_once(self.merge(workers))
+        self.assert_taken_over(stalled, workers[-1])
+        self.assertEqual(workers[-1].exitcode, 0)
+
+    def test_repeated_rollbacks(self):
+        # a worker rolls back two tasks in a row, which mustn't touch the
+        # rows of the task it finished before them
+        self.tasks = self.tasks[:3]
+        self.queue.publish(self.tasks)
+        OTHER_WORKER['queue'] = self.queue
+        stat_logger.reset()
+        stat_logger.requireLoggers('out')
+        self.assertEqual(lease.work(log_rows_finished_elsewhere,
+                                    self.log_dir, GRID_POINTS,
+                                    lease_timeout=LEASE_TIMEOUT,
+                                    poll_interval=0.05), 1)
+        self.markers = dict((task, self.queue.marker(task))
+                            for task in self.tasks)
+        self.assert_logged_once(self.merge([]), tasks=self.tasks[:1])
+
+    def test_other_sweep(self):
+        # leases and done markers of another sweep don't count
+        self.queue.publish(self.tasks)
+        self.assertEqual(self.queue.acquire('old', self.tasks), (0, 0))
+        self.assertTrue(self.queue.complete((0, 0), {'worker': 'old'}))
+        self.assertEqual(self.queue.acquire('old', self.tasks), (1, 0))
+
+        old_sweep = self.queue.sweep
+        self.queue.publish(self.tasks)
+        self.assertNotEqual(self.queue.sweep, old_sweep)
+        self.assertFalse(self.queue.is_done((0, 0)))
+        self.assertEqual(self.queue.acquire('new', self.tasks), (0, 0))
+        self.assertEqual(self.queue.acquire('new', self.tasks), (1, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+""" Checks that loads without overwriting pick up from the watermark of the
+dump they load, and never from one left by another dump of the table.
+
+The loading tests need a PostgreSQL server on localhost; set
+PYHARNESS_TEST_DB to the name of a database they may create schemas in.
+Run with `python -m unittest discover tests`.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pyharness import stat_loader, stat_logger
+
+TEST_DB = os.environ.get('PYHARNESS_TEST_DB')
+
+SCHEMA_NAME = 'pyharness_test_stat_loader'
+
+def log_dump(log_dir, n_rows, append=False):
+    stat_logger.reset()
+    stat_logger.configure(settings={'log_dir': log_dir, 'append': append},
+                          defaults={'grid_point_id': 0, 'run_id': 0})
+    stat_logger.requireLoggers('out')
+    log = stat_logger.getLogger('out')
+    for i in range(n_rows):
+        log.log(i=i)
+        log.end_row()
+    stat_logger.finalize()
+    stat_logger.reset()
+    return os.path.join(log_dir, 'out.json')
+
+class DumpIdTest(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        stat_logger.reset()
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+
+    def test_new_dump(self):
+        filename = log_dump(self.log_dir, 3)
+        dump_id = stat_loader.dump_identity(filename)
+        log_dump(self.log_dir, 10)
+        self.assertNotEqual(stat_loader.dump_identity(filename), dump_id)
+
+    def test_appended_dump(self):
+        filename = log_dump(self.log_dir, 3)
+        dump_id = stat_loader.dump_identity(filename)
+        stat_logger.rollback(self.log_dir, {'out': os.path.getsize(filename)
+                                            + 1})
+        log_dump(self.log_dir, 2, append=True)
+        self.assertEqual(stat_loader.dump_identity(filename), dump_id)
+
+@unittest.skipUnless(TEST_DB, "PYHARNESS_TEST_DB isn't set")
+class WatermarkTest(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'wb')
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def tearDown(self):
+        stat_logger.reset()
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+        self.db().execute('DROP SCHEMA IF EXISTS %s CASCADE' % SCHEMA_NAME)
+
+    def db(self):
+        from sqlalchemy import create_engine
+        return create_engine("postgresql://localhost/" + TEST_DB)
+
+    def load(self, overwrite=False):
+        stat_loader.to_postgres(self.log_dir, TEST_DB, SCHEMA_NAME,
+                                overwrite=overwrite)
+        return sorted(row[0] for row in self.db().execute(
+            'SELECT i FROM %s.out' % SCHEMA_NAME))
+
+    def test_rewritten_dump(self):
+        # a later sweep rewrites the dump; its rows are all loaded
+        log_dump(self.log_dir, 3)
+        self.assertEqual(self.load(overwrite=True), range(3))
+        log_dump(self.log_dir, 10)
+        self.assertEqual(self.load(), range(3) + range(10))
+
+    def test_appended_dump(self):
+        # a resumed sweep appends to the dump; only its new rows are loaded
+        filename = log_dump(self.log_dir, 3)
+        self.assertEqual(self.load(overwrite=True), range(3))
+        stat_logger.rollback(self.log_dir, {'out': os.path.getsize(filename)
+                                            + 1})
+        log_dump(self.log_dir, 2, append=True)
+        self.assertEqual(self.load(), sorted(range(3) + range(2)))
+
+if __name__ == '__main__':
+    unittest.main()